@@ -0,0 +1,240 @@
+# Copyright (c) 2016-Present Pivotal Software, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+DEFAULT_INDEX_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_ARTEFACT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# ioctl to share the extents of a file on copy-on-write filesystems (btrfs, xfs, overlayfs on top of them)
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1024 * 1024 * 1024
+# entries are locked through a fixed number of lock files, rather than one file per entry ever cached
+LOCK_STRIPES = 64
+LOCK_PREFIX = 'stripe-'
+
+
+class _CacheDirectory:
+    """ Directory of cache entries named `<key><SUFFIX>`, evicted least recently used first. """
+
+    SUFFIX = ''
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _key_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    @contextmanager
+    def _lock(self, key: str):
+        """
+        Exclusive lock on an entry, shared by all processes using the cache directory.
+        Entries whose keys fall on the same stripe share their lock.
+        """
+        stripe = int(hashlib.sha256(key.encode('utf-8')).hexdigest()[:8], 16) % LOCK_STRIPES
+        with open(os.path.join(self.directory, '{}{:02d}.lock'.format(LOCK_PREFIX, stripe)), 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for direntry in it:
+                if direntry.name.endswith('.lock') and not direntry.name.startswith(LOCK_PREFIX):
+                    # a lock file per entry, as left behind by earlier versions
+                    try:
+                        os.unlink(direntry.path)
+                    except OSError:
+                        pass
+                    continue
+                if not direntry.name.endswith(self.SUFFIX):
+                    continue
+                try:
+                    stat = direntry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, direntry.path))
+                total += stat.st_size
+
+        for unused_mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class IndexCache(_CacheDirectory):
+    """
+    On-disk cache for index pages.
+
+    Every entry keeps the raw page together with its ETag/Last-Modified validators
+    and the candidate lists already parsed from it. Entries are evicted least
+    recently used first once the cache directory grows beyond `max_size` bytes.
+    """
+
+    SUFFIX = '.json'
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_INDEX_CACHE_SIZE):
+        super().__init__(directory, max_size)
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _path(self, url: str) -> str:
+        return self._key_path(self._key(url))
+
+    def lock(self, url: str):
+        return self._lock(self._key(url))
+
+    def get(self, url: str) -> Optional[Dict]:
+        path = self._path(url)
+        try:
+            with open(path, 'r') as file:
+                entry = json.load(file)
+            # mark as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != url:
+            return None
+        return entry
+
+    def put(self, url: str, entry: Dict):
+        entry = dict(entry, url=url)
+        fd, tmppath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(entry, file)
+            # atomic, so that concurrent readers never see a partial entry
+            os.replace(tmppath, self._path(url))
+        except BaseException:
+            if os.path.exists(tmppath):
+                os.unlink(tmppath)
+            raise
+        self.evict()
+
+    @staticmethod
+    def conditional_headers(entry: Optional[Dict]) -> Dict[str, str]:
+        """ Request headers to revalidate a cached entry. """
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+
+def materialize(source: str, target: str, link: bool = True) -> str:
+    """
+    Make the content of `source` available at `target` without copying it through userspace:
+    a reflink if the filesystem supports it, else a hardlink (if `link`), else
+    `copy_file_range`. Returns the method used.
+    """
+    if os.path.lexists(target):
+        os.unlink(target)
+
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return 'reflink'
+        except OSError:
+            pass
+
+    if link:
+        try:
+            os.unlink(target)
+            os.link(source, target)
+            return 'hardlink'
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), COPY_CHUNK_SIZE):
+                    pass
+                return 'copy_file_range'
+            except OSError:
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+        return 'copy'
+
+
+class ArtefactCache(_CacheDirectory):
+    """
+    Content-addressed store of downloaded artefacts, keyed by the digest the index publishes.
+
+    Entries are only added after their digest has been verified and are read-only, since
+    they may be hardlinked into the output directories of several resources.
+    """
+
+    SUFFIX = '.artefact'
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_ARTEFACT_CACHE_SIZE):
+        super().__init__(directory, max_size)
+
+    @staticmethod
+    def _key(hash_name: str, digest: str) -> str:
+        return '{}-{}'.format(hash_name, digest)
+
+    def lock(self, hash_name: str, digest: str):
+        return self._lock(self._key(hash_name, digest))
+
+    def get(self, hash_name: str, digest: str, target: str) -> Optional[str]:
+        """ Materialize the entry at `target`, returns the method used or `None` on a miss. """
+        path = self._key_path(self._key(hash_name, digest))
+        try:
+            method = materialize(path, target)
+            # mark as recently used
+            os.utime(path)
+        except OSError:
+            if os.path.exists(target):
+                os.unlink(target)
+            return None
+        return method
+
+    def put(self, hash_name: str, digest: str, source: str):
+        fd, tmppath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            materialize(source, tmppath, link=False)
+            os.chmod(tmppath, 0o444)
+            os.replace(tmppath, self._key_path(self._key(hash_name, digest)))
+        except BaseException:
+            if os.path.exists(tmppath):
+                os.unlink(tmppath)
+            raise
+        self.evict()
@@ -17,9 +17,11 @@
 import json
 import sys
 from bisect import bisect_left
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Dict, List
 
-from . import common, pipio
+from . import common, pipio, trace, versioning
 
 
 def truncate_smaller_versions(lst: List, value: pipio.Version) -> List:
@@ -32,22 +34,112 @@ def truncate_smaller_versions(lst: List, value: pipio.Version) -> List:
         return lst[index:] if index < len(lst) else [lst[-1]]
 
 
-def check(instream):
-    resconfig = json.load(instream)
-    resconfig = common.merge_defaults(resconfig)
+CHECK_WORKERS = 8
+# keys of an artefact recorded in the version with `source.version_artefact`
+VERSION_ARTEFACT_KEYS = ['filename', 'hash', 'url']
+
+
+def version_dict(resconfig, version: pipio.Version, package_info: Dict) -> Dict:
+    """ A version as reported to Concourse, with its first artefact if `source.version_artefact` is set. """
+    if resconfig['source'].get('version_artefact', False):
+        # let `in` download the first artefact without querying the index again
+        artefact = package_info[version]['artefacts'][0]
+        return dict({key: artefact[key] for key in VERSION_ARTEFACT_KEYS}, version=str(version))
+    return {'version': str(version)}
+
 
-    package_info = pipio.pip_get_versions(resconfig)
+def check_versions(resconfig, session=None) -> List[Dict]:
+    """ Versions to report for a resource whose configuration has been merged with the defaults. """
+    current = resconfig['version']['version']
+    package_info = pipio.pip_get_versions(resconfig, session, min_version=current)
+    if current and not package_info:
+        # the current version is gone, report the latest one again
+        package_info = pipio.pip_get_versions(resconfig, session)
 
-    versions = list(sorted(package_info.keys()))
+    versions = versioning.sort_versions(package_info.keys())
     common.msg("{}", versions)
-    versions = truncate_smaller_versions(versions, resconfig['version']['version'])
+    versions = truncate_smaller_versions(versions, current)
 
     # NOTE: check only takes versions, no metadata
-    return [{'version': str(version)} for version in versions]
+    return [version_dict(resconfig, version, package_info) for version in versions]
+
+
+def check(instream):
+    resconfig = json.load(instream)
+    trace.configure(resconfig)
+    with trace.span('check'):
+        with trace.span('merge_defaults'):
+            resconfig = common.merge_defaults(resconfig)
+        return check_versions(resconfig)
+
+
+def _repository_key(resconfig) -> str:
+    return json.dumps(resconfig['source']['repository'], sort_keys=True)
+
+
+def check_many(resconfigs: List[Dict], workers: int = CHECK_WORKERS) -> List[Dict]:
+    """
+    Check several resources (e.g. one per package) within one process.
+
+    The index queries run concurrently on up to `workers` threads; resources with the same
+    repository configuration share one session and thereby its connections. Returns one
+    `{'name': ..., 'versions': [...]}` per resource, in order, or `{'name': ..., 'error': ...}`
+    if checking that resource failed.
+    """
+    def failed(resconfig, e):
+        name = resconfig.get('source', {}).get('name', None)
+        common.msg("Checking {} failed: {}", name, e)
+        return {'name': name, 'error': '{}: {}'.format(type(e).__name__, e)}
+
+    # an invalid configuration only fails its own resource
+    results = [None] * len(resconfigs)
+    merged = []
+    for i, resconfig in enumerate(resconfigs):
+        try:
+            merged.append((i, common.merge_defaults(resconfig)))
+        except Exception as e:
+            results[i] = failed(resconfig, e)
+
+    workers = max(1, min(workers, len(merged)))
+    with ExitStack() as stack:
+        sessions = {}
+        for unused_i, resconfig in merged:
+            key = _repository_key(resconfig)
+            if key not in sessions:
+                try:
+                    sessions[key] = stack.enter_context(pipio.open_session(resconfig, workers))
+                except Exception as e:
+                    # a repository without a session only fails its own resources
+                    sessions[key] = e
+
+        def check_one(resconfig):
+            name = resconfig['source']['name']
+            session = sessions[_repository_key(resconfig)]
+            if isinstance(session, Exception):
+                return failed(resconfig, session)
+            try:
+                with trace.span('check', package=name):
+                    return {'name': name, 'versions': check_versions(resconfig, session)}
+            except Exception as e:
+                return failed(resconfig, e)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            checked = executor.map(trace.propagate(check_one), [resconfig for unused_i, resconfig in merged])
+            for (i, unused_resconfig), result in zip(merged, checked):
+                results[i] = result
+    return results
 
 
 def main():
-    print(json.dumps(check(sys.stdin)))
+    if sys.argv[1:] == ['--batch']:
+        # a JSON list of check inputs, e.g. for a wrapper watching many packages
+        resconfigs = json.load(sys.stdin)
+        for resconfig in resconfigs:
+            trace.configure(resconfig)
+        with trace.span('check_many', resources=len(resconfigs)):
+            print(json.dumps(check_many(resconfigs)))
+    else:
+        print(json.dumps(check(sys.stdin)))
 
 
 if __name__ == '__main__':
@@ -14,11 +14,14 @@
 
 import re
 import sys
-from typing import Dict, List
+import tarfile
+import zipfile
+from functools import lru_cache
+from typing import Dict, List, Optional
 
-import pkginfo
+from packaging.version import InvalidVersion, Version
 
-from . import pipio
+from . import metadata, trace, versioning
 
 
 def msg(msg, *args, **kwargs):
@@ -40,12 +43,9 @@ def is_deprecated_python_version_parameter(python_version: str) -> bool:
     return False
 
 
-def py_version_to_semver(version: pipio.Version) -> str:
+def py_version_to_semver(version: Version) -> str:
     try:
-        if isinstance(version, pipio.Version):
-            v = version
-        else:
-            v = pipio.Version(str(version))
+        v = versioning.as_version(version)
         
         result = '.'.join([str(x) for x in v.release])
         if len(v.release) < 3:
@@ -64,7 +64,7 @@ def py_version_to_semver(version: pipio.Version) -> str:
         if v.dev:
             result += '+dev{:06d}'.format(v.dev)
 
-    except pipio.InvalidVersion:
+    except InvalidVersion:
         msg("Failed to convert Python version '{}' to semver format", version)
         result = None
 
@@ -86,9 +86,20 @@ def check_source(resconfig):
         'filename_match',
         'packaging',
         'platform',
+        'python_abi',
+        'python_implementation',
         'python_version',
         'pre_release',
         'release',
+        'version_spec',
+        'version_artefact',
+        'index_cache_dir',
+        'index_cache_max_size',
+        'index_cache_ttl',
+        'artefact_cache_dir',
+        'artefact_cache_max_size',
+        'http_pool_size',
+        'trace',
         'test',
     }
     
@@ -107,8 +118,10 @@ def check_source(resconfig):
             'username',
             'password',
             'index_url',
+            'index_api',
             'repository_url',
             'test',
+            'verify',
         }
         delta = keys.difference(available_keys)
         if delta:
@@ -144,6 +157,13 @@ def merge_defaults(resconfig):
             source['filename_match'] = python_version
     source.setdefault('python_version', None)
 
+    python_abi = source.get('python_abi', None)
+    if isinstance(python_abi, str):
+        python_abi = python_abi.split(',')
+    source['python_abi'] = tuple(abi.strip() for abi in python_abi) if python_abi else None
+    source.setdefault('python_implementation', None)
+    assert source['python_implementation'] in [None, 'cp', 'pp', 'ip', 'jy', 'py']
+
     #
     # setup source.repository
     #
@@ -164,6 +184,8 @@ def merge_defaults(resconfig):
 
     repository.setdefault('repository_url', 'https://upload.pypi.org/legacy/')
     repository.setdefault('index_url', 'https://pypi.org/simple')
+    repository.setdefault('index_api', 'simple')
+    assert repository['index_api'] in ['simple', 'json']
 
     #
     # setup version
@@ -172,22 +194,40 @@ def merge_defaults(resconfig):
         resconfig['version'] = dict()
     resconfig['version'].setdefault('version', None)
     if resconfig['version'].get('version', None):
-        resconfig['version']['version'] = pipio.Version(resconfig['version']['version'])
+        resconfig['version']['version'] = versioning.parse_version(resconfig['version']['version'])
 
     return resconfig
 
 
+@lru_cache(maxsize=None)
+def _read_package_metadata(pkgpath) -> Optional[bytes]:
+    """ Core metadata read by `metadata.read_package_metadata`, `None` if it cannot handle the file. """
+    try:
+        return metadata.read_package_metadata(pkgpath)
+    except (OSError, ValueError, tarfile.TarError, zipfile.BadZipFile) as e:
+        msg("Reading metadata of {} directly failed ({}), using pkginfo", pkgpath, e)
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_package_metadata(pkgpath):
+    """ Parse (once) the metadata of a distribution file or unpacked sdist. """
+    import pkginfo  # only needed by out
+
+    data = _read_package_metadata(pkgpath)
+    if data is None:
+        return pkginfo.get_metadata(pkgpath)
+    pkgmeta = pkginfo.Distribution()
+    pkgmeta.parse(data)
+    return pkgmeta
+
+
 def get_package_info(pkgpath):
     """ Provide a subset of the package metadata to merge into the Concourse resource metadata. """
-    pkgmeta = pkginfo.get_metadata(pkgpath)
-    result = {
-        'version': pkgmeta.version,
-        'metadata': {
-            'package_name': pkgmeta.name,
-            'summary': pkgmeta.summary,
-            'home_page': pkgmeta.home_page,
-            'platforms': ', '.join(pkgmeta.platforms),
-            'requires_python': pkgmeta.requires_python,
-        }
-    }
-    return result
+    with trace.span('package_info', path=pkgpath):
+        data = _read_package_metadata(pkgpath)
+        if data is not None:
+            return metadata.parse_metadata(data)
+        pkgmeta = get_package_metadata(pkgpath)
+    return metadata.package_info(pkgmeta.version, pkgmeta.name, pkgmeta.summary, pkgmeta.home_page,
+                                 pkgmeta.platforms, pkgmeta.requires_python)
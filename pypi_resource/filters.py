@@ -0,0 +1,139 @@
+# Copyright (c) 2016-Present Pivotal Software, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Selection of distribution files by the `source` options of a resource.
+
+The options are compiled once into predicates that run from cheapest to most expensive:
+the filename (before anything is parsed), the version (once per distinct version string)
+and finally wheel tags and Requires-Python of the remaining candidates.
+"""
+
+import re
+import sys
+from fnmatch import translate
+from typing import Callable, Dict, FrozenSet, Optional
+
+from packaging.specifiers import InvalidSpecifier, SpecifierSet
+from packaging.version import InvalidVersion, Version
+
+from . import index, versioning
+
+
+def compile_filename_match(pattern: Optional[str]) -> Callable[[str], bool]:
+    """
+    Predicate for the `filename_match` option: a substring of the filename, or a
+    glob (`glob:*manylinux*.whl`) or regular expression (`re:cp3\\d+-`) with a prefix.
+    """
+    if not pattern:
+        return lambda filename: True
+    if pattern.startswith('glob:'):
+        return re.compile(translate(pattern[len('glob:'):])).match
+    if pattern.startswith('re:'):
+        return re.compile(pattern[len('re:'):]).search
+    return lambda filename: pattern in filename
+
+
+def target_python(resconfig) -> str:
+    python_version = resconfig['source']['python_version']
+    version_info = index.python_version_info(python_version) if python_version else sys.version_info[:3]
+    version_info = tuple(version_info) + (3 - len(version_info)) * (0, )
+    return '.'.join(str(x) for x in version_info[:3])
+
+
+class CandidateFilter:
+    """
+    The selection options of a resource, plus an optional `min_version` below which
+    versions are of no interest (e.g. the version `check` was given) or the single
+    `version` of interest (e.g. the version `in` was given).
+    """
+
+    def __init__(self, resconfig, min_version: Version = None, version: Version = None):
+        source = resconfig['source']
+        self.resconfig = resconfig
+        self.packaging = source['packaging']
+        self.pre_release = source['pre_release']
+        self.release = source['release']
+        self.min_version = min_version
+        self.version = version
+        self.version_spec = SpecifierSet(source['version_spec']) if source.get('version_spec', None) else None
+        self.filename_match = compile_filename_match(source.get('filename_match', None))
+        self.target_python = target_python(resconfig)
+        self._supported_tags = None
+        self._compatible: Dict[FrozenSet, bool] = {}
+        self._versions: Dict[str, Optional[Version]] = {}
+        self._accepted: Dict[Version, bool] = {}
+        self._requires_python: Dict[str, bool] = {}
+
+    @property
+    def supported_tags(self):
+        if self._supported_tags is None:
+            source = self.resconfig['source']
+            self._supported_tags = index.supported_tags(source.get('platform', None), source['python_version'],
+                                                        source.get('python_abi', None),
+                                                        source.get('python_implementation', None))
+        return self._supported_tags
+
+    def accepts_wheel_tags(self, wheel_tags: FrozenSet) -> bool:
+        # most releases of a project publish the same set of tags
+        compatible = self._compatible.get(wheel_tags, None)
+        if compatible is None:
+            compatible = not self.supported_tags.isdisjoint(wheel_tags)
+            self._compatible[wheel_tags] = compatible
+        return compatible
+
+    def accepts_filename(self, filename: str) -> bool:
+        is_wheel = filename.endswith(index.WHEEL_EXTENSION)
+        if (self.packaging == 'source' and is_wheel) or (self.packaging == 'binary' and not is_wheel):
+            return False
+        return bool(self.filename_match(filename))
+
+    def accepts_version(self, version: Version) -> bool:
+        accepted = self._accepted.get(version, None)
+        if accepted is None:
+            prerelease = version.is_prerelease or version.is_devrelease
+            accepted = ((self.version is None or version == self.version)
+                        and (self.pre_release or not prerelease)
+                        and (self.release or prerelease)
+                        and (self.min_version is None or version >= self.min_version)
+                        and (self.version_spec is None or self.version_spec.contains(version, prereleases=True)))
+            self._accepted[version] = accepted
+        return accepted
+
+    def parse_version(self, version: str) -> Optional[Version]:
+        """ The parsed version if it is accepted, parsing every distinct version string once. """
+        if version not in self._versions:
+            try:
+                parsed = versioning.parse_version(version)
+            except InvalidVersion:
+                parsed = None
+            self._versions[version] = parsed if parsed is not None and self.accepts_version(parsed) else None
+        return self._versions[version]
+
+    def _accepts_requires_python(self, requires_python: str) -> bool:
+        if requires_python not in self._requires_python:
+            try:
+                accepted = SpecifierSet(requires_python).contains(self.target_python, prereleases=True)
+            except InvalidSpecifier:
+                # pip ignores invalid metadata here as well
+                accepted = True
+            self._requires_python[requires_python] = accepted
+        return self._requires_python[requires_python]
+
+    def accepts(self, candidate: index.Candidate) -> bool:
+        if not (self.accepts_filename(candidate.filename) and self.accepts_version(candidate.version)):
+            return False
+        if candidate.is_wheel and not self.accepts_wheel_tags(candidate.wheel_tags):
+            return False
+        return not candidate.requires_python or self._accepts_requires_python(candidate.requires_python)
@@ -0,0 +1,85 @@
+# Copyright (c) 2016-Present Pivotal Software, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Digests computed on background threads while the caller keeps transferring data.
+
+hashlib releases the GIL while hashing larger buffers, so a thread per digest runs in
+parallel with network and disk I/O (and with the other digests) instead of after it.
+"""
+
+import queue
+import threading
+from typing import Dict
+
+# chunks waiting to be hashed per digest, bounds the memory held by the pipeline
+QUEUE_SIZE = 8
+
+_DONE = object()
+
+
+class HashingPipeline:
+    """
+    Feed chunks to several hashers, each updated on its own thread::
+
+        with HashingPipeline({'sha256': hashlib.sha256()}) as pipeline:
+            for chunk in chunks:
+                pipeline.update(chunk)
+        pipeline.hexdigests()
+
+    `update` only blocks while a hasher is `QUEUE_SIZE` chunks behind.
+    """
+
+    def __init__(self, hashers: Dict[str, object], queue_size: int = QUEUE_SIZE):
+        self.hashers = hashers
+        self.closed = False
+        self._queues = []
+        self._threads = []
+        for name, hasher in hashers.items():
+            chunks = queue.Queue(maxsize=queue_size)
+            thread = threading.Thread(target=self._run, args=(hasher, chunks), name='hash-' + name, daemon=True)
+            thread.start()
+            self._queues.append(chunks)
+            self._threads.append(thread)
+
+    @staticmethod
+    def _run(hasher, chunks: queue.Queue):
+        for chunk in iter(chunks.get, _DONE):
+            hasher.update(chunk)
+
+    def update(self, chunk: bytes):
+        if self.closed:
+            raise ValueError('update of a closed hashing pipeline')
+        for chunks in self._queues:
+            chunks.put(chunk)
+
+    def close(self):
+        """ Wait for the queued chunks to be hashed. """
+        if self.closed:
+            return
+        self.closed = True
+        for chunks in self._queues:
+            chunks.put(_DONE)
+        for thread in self._threads:
+            thread.join()
+
+    def hexdigests(self) -> Dict[str, str]:
+        self.close()
+        return {name: hasher.hexdigest() for name, hasher in self.hashers.items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
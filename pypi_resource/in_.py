@@ -17,13 +17,32 @@ import glob
 import json
 import os
 import sys
+from fnmatch import fnmatch
+from typing import Dict, List, Optional
 
-from . import common, pipio
-from .retry import retry_wrapper
+import requests
+
+from . import common, index, metadata, pipio, trace, versioning
+from .check import VERSION_ARTEFACT_KEYS
+from .retry import RetryPolicy, TransientError
 
 
 RETRIES = 20
 DELAY = 3
+MAX_DELAY = 30
+DOWNLOAD_WORKERS = 4
+# responses to a recorded artefact url that make `in` query the index instead
+STALE_STATUS = {403, 404, 410}
+
+
+class VersionNotFoundError(TransientError, ValueError):
+    """ The index does not list the version (yet), e.g. right after it has been uploaded. """
+    pass
+
+
+class NoMatchingPackagesError(ValueError):
+    """ The index does not know the package or lists no files matching the selection options, retrying won't help. """
+    pass
 
 
 def select_artefact_for_response(package_info, version: pipio.Version, artefact_index: int=0):
@@ -34,69 +53,168 @@ def select_artefact_for_response(package_info, version: pipio.Version, artefact_
     item = package_info[version]
     artefacts = item['artefacts']
 
-    metadata = item['metadata'].copy()
+    response_metadata = item['metadata'].copy()
 
     # this artefact has been chosen to represent this version
     if artefact_index > len(artefacts):
         raise KeyError('no artefact{} found for version {}'.format(artefact_index, version))
-    metadata.update(item['artefacts'][artefact_index])
+    response_metadata.update({key: artefacts[artefact_index][key] for key in ['filename', 'hash', 'url']})
 
     # list all artefacts that match the search pattern
     for i, artefact in enumerate(artefacts):
-        metadata['artefact{:d}'.format(i)] = artefact['filename']
+        response_metadata['artefact{:d}'.format(i)] = artefact['filename']
 
     return {
         'version': {'version': str(version)},
-        'metadata': metadata,
+        'metadata': response_metadata,
     }
 
 
-def download_version(resconfig, destdir):
-    # fetch all matching versions/artifacts
-    package_info = pipio.pip_get_versions(resconfig)
-    if not package_info:
-        raise ValueError("No matching packages found.")
+def select_artefacts(artefacts: List[Dict], selection) -> List[Dict]:
+    """
+    Pick the artefacts to download according to `params.artefacts`: `first` (default),
+    `all` or one or more filename patterns.
+    """
+    if not selection or selection == 'first':
+        return artefacts[:1]
+    elif selection == 'all':
+        return artefacts
+    if isinstance(selection, str):
+        selection = [selection]
+    return [a for a in artefacts if any(fnmatch(a['filename'], pattern) for pattern in selection)]
+
 
+def list_version(resconfig, session=None):
+    """ Fetch the artefacts of the requested version, or of all matching versions to pick the newest one. """
     version = resconfig['version']['version']
-    if not version:
-        version = max(package_info.keys())
+    package_info = pipio.pip_get_versions(resconfig, session, version=version)
+    if version:
+        # a pinned version may not be listed yet, e.g. the first release of a package right after `put`
+        if version not in package_info:
+            raise VersionNotFoundError("Version {} is not listed by the index.".format(version))
+    elif not package_info:
+        raise NoMatchingPackagesError("No matching packages found.")
+    else:
+        version = versioning.max_version(package_info.keys())
+    return package_info, version
+
+
+def version_artefact(resconfig) -> Optional[Dict]:
+    """
+    The artefact `check` recorded in the requested version (see `source.version_artefact`),
+    if it is the one `params.artefacts` selects.
+    """
+    version = resconfig['version']
+    if not version['version'] or not all(version.get(key, None) for key in VERSION_ARTEFACT_KEYS):
+        return None
+    if resconfig.get('params', {}).get('artefacts', 'first') not in [None, 'first']:
+        return None
+    return {key: version[key] for key in VERSION_ARTEFACT_KEYS}
+
+
+def package_info_from_artefact(resconfig, artefact: Dict):
+    """ The package info `list_version` would return for an artefact recorded in the version. """
+    version = resconfig['version']['version']
+    candidate = index.to_candidate(resconfig['source']['name'], {
+        'filename': artefact['filename'], 'url': artefact['url'], 'hashes': {}, 'requires_python': None,
+        'yanked': False})
+    package_key = candidate.name if candidate else resconfig['source']['name']
+    return {version: {'artefacts': [artefact], 'metadata': {'package_key': package_key}}}, version
+
+
+def download_version(resconfig, destdir, policy: RetryPolicy = None, session=None):
+    """
+    Download the selected artefact(s) of a version into `destdir`.
+
+    Every stage (listing, metadata, downloads) is retried on its own according to `policy`,
+    so a failed download does not fetch the index again. All stages share one `session`.
+    An artefact recorded in the version by `check` is downloaded without listing the
+    versions, unless its url is no longer served.
+
+    Returns the response for Concourse and, if `params.metadata_only` is set and the index
+    made it possible to get the core metadata without downloading, the parsed package info.
+    """
+    params = resconfig.get('params', {})
+    workers = params.get('download_workers', DOWNLOAD_WORKERS)
+    if session is None:
+        with pipio.open_session(resconfig, workers) as session:
+            return download_version(resconfig, destdir, policy, session)
+
+    policy = policy or RetryPolicy(count=1)
+    artefact = version_artefact(resconfig)
+    if artefact:
+        try:
+            package_info, version = package_info_from_artefact(resconfig, artefact)
+            return _download_selected(resconfig, destdir, policy, session, package_info, version)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in STALE_STATUS:
+                raise
+            common.msg("{} is not available at {} anymore ({}), querying the index",
+                       artefact['filename'], artefact['url'], e.response.status_code)
+
+    package_info, version = policy.call(list_version, resconfig, session, stage='list versions')
+    return _download_selected(resconfig, destdir, policy, session, package_info, version)
+
+
+def _download_selected(resconfig, destdir, policy: RetryPolicy, session, package_info, version):
+    params = resconfig.get('params', {})
+    workers = params.get('download_workers', DOWNLOAD_WORKERS)
     artefacts = package_info[version]['artefacts']
 
     # select requested version
-    if len(artefacts) > 1:
-        common.msg("selecting first out of {} artefacts matching the selection criteria", len(artefacts))
-    response = select_artefact_for_response(package_info, version)
-    url = artefacts[0]['url']
-
-    pipio.pip_download_link(resconfig, url, destdir)
-    return response
+    selected = select_artefacts(artefacts, params.get('artefacts', None))
+    if not selected:
+        raise ValueError("No artefacts of version {} match {}".format(version, params['artefacts']))
+    if len(artefacts) > len(selected):
+        common.msg("selecting {} out of {} artefacts matching the selection criteria", len(selected), len(artefacts))
+    response = select_artefact_for_response(package_info, version, artefacts.index(selected[0]))
+
+    if params.get('metadata_only', False):
+        data = policy.call(pipio.pip_fetch_metadata, resconfig, selected[0], session, stage='fetch metadata')
+        if data is not None:
+            return response, metadata.parse_metadata(data)
+        common.msg("Core metadata of {} is not available separately, downloading", selected[0]['filename'])
+
+    if len(selected) == 1:
+        policy.call(pipio.pip_download_link, resconfig, selected[0]['url'], destdir, selected[0]['hash'], session,
+                    stage='download ' + selected[0]['filename'])
+    else:
+        pipio.pip_download_links(resconfig, selected, destdir, workers, policy=policy, session=session)
+    return response, None
 
 
 def in_(destdir, instream):
     resconfig = json.load(instream)
-    common.merge_defaults(resconfig)
-
-    retries = resconfig.get('params', {}).get('count_retries', RETRIES)
-    delay = resconfig.get('params', {}).get('delay_between_retries', DELAY)
-    download = retry_wrapper(retries, delay)(download_version)
-    response = download(resconfig, destdir)
-
-    # fetch metadata from download
-    wheel = glob.glob(os.path.join(destdir, '*.whl'))
-    package_info_path = wheel[0] if wheel else destdir
-    pkg_info = common.get_package_info(package_info_path)
-    response['metadata'].update(pkg_info['metadata'])
-
-    # provide other output files
-    version = pkg_info['version']
-    with open(os.path.join(destdir, 'version'), 'w') as file:
-        file.write(str(version))
-    semver = common.py_version_to_semver(str(version))
-    if semver:
-        with open(os.path.join(destdir, 'semver'), 'w') as file:
-            file.write(semver)
-
-    response['metadata'] = common.metadata_dict_to_kvlist(response['metadata'])
+    trace.configure(resconfig)
+    with trace.span('in'):
+        with trace.span('merge_defaults'):
+            common.merge_defaults(resconfig)
+
+        params = resconfig.get('params', {})
+        policy = RetryPolicy(params.get('count_retries', RETRIES), params.get('delay_between_retries', DELAY),
+                             params.get('max_delay_between_retries', MAX_DELAY))
+        response, pkg_info = download_version(resconfig, destdir, policy)
+        # report the version as given (including an artefact recorded by check), so that Concourse
+        # does not record another one
+        response['version'] = dict(resconfig['version'], version=response['version']['version'])
+
+        if pkg_info is None:
+            # fetch metadata from download
+            wheel = glob.glob(os.path.join(destdir, '*.whl'))
+            package_info_path = wheel[0] if wheel else destdir
+            pkg_info = common.get_package_info(package_info_path)
+        response['metadata'].update(pkg_info['metadata'])
+
+        # provide other output files
+        version = pkg_info['version']
+        with open(os.path.join(destdir, 'version'), 'w') as file:
+            file.write(str(version))
+        semver = common.py_version_to_semver(str(version))
+        if semver:
+            with open(os.path.join(destdir, 'semver'), 'w') as file:
+                file.write(semver)
+
+        response['metadata'] = common.metadata_dict_to_kvlist(response['metadata'])
     return response
 
 
@@ -0,0 +1,351 @@
+# Copyright (c) 2016-Present Pivotal Software, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+from urllib.parse import unquote, urldefrag, urljoin, urlsplit
+
+from packaging import tags
+from packaging.version import InvalidVersion, Version
+
+SIMPLE_JSON = 'application/vnd.pypi.simple.v1+json'
+SIMPLE_HTML = 'application/vnd.pypi.simple.v1+html'
+ACCEPT = '{}, {};q=0.2, text/html;q=0.01'.format(SIMPLE_JSON, SIMPLE_HTML)
+
+WHEEL_EXTENSION = '.whl'
+SDIST_EXTENSIONS = (
+    '.tar.gz', '.tgz', '.tar.bz2', '.tbz', '.tar.xz', '.txz',
+    '.tlz', '.tar.lz', '.tar.lzma', '.zip', '.tar',
+)
+HASH_PREFERENCE = ['sha256', 'sha384', 'sha512', 'sha224', 'sha1', 'md5']
+
+
+def canonicalize_name(name: str) -> str:
+    """ PEP 503 normalized project name. """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def project_url(index_url: str, package_name: str) -> str:
+    """ PEP 503 project page below an index url. """
+    return '{}/{}/'.format(index_url.rstrip('/'), canonicalize_name(package_name))
+
+
+def legacy_json_url(index_url: str, package_name: str, version: str = None) -> str:
+    """ Warehouse JSON API url next to a `.../simple` index url, of a single release if `version` is given. """
+    root = index_url.rstrip('/')
+    if root.endswith('/simple'):
+        root = root[:-len('/simple')]
+    if version:
+        return '{}/pypi/{}/{}/json'.format(root, package_name, version)
+    return '{}/pypi/{}/json'.format(root, package_name)
+
+
+def _split_wheel_filename(filename: str) -> List[str]:
+    parts = filename[:-len(WHEEL_EXTENSION)].split('-')
+    if len(parts) not in (5, 6):
+        raise ValueError('invalid wheel filename: {}'.format(filename))
+    return parts
+
+
+def parse_wheel_filename(filename: str) -> Tuple[str, str, FrozenSet[tags.Tag]]:
+    """ Split a PEP 427 wheel filename into project name, version and tags. """
+    parts = _split_wheel_filename(filename)
+    return parts[0], parts[1], tags.parse_tag('-'.join(parts[-3:]))
+
+
+def sdist_extension(filename: str) -> Optional[str]:
+    lowered = filename.lower()
+    for extension in SDIST_EXTENSIONS:
+        if lowered.endswith(extension):
+            return extension
+    return None
+
+
+def parse_sdist_filename(filename: str, project: str) -> Tuple[str, str]:
+    """
+    Split a source distribution filename into project name and version.
+
+    Legacy sdists do not escape dashes within the project name, so the split is
+    anchored on the (canonical) name of the project being looked up.
+    """
+    extension = sdist_extension(filename)
+    if not extension:
+        raise ValueError('unsupported archive format: {}'.format(filename))
+    stem = filename[:-len(extension)]
+    canonical = canonicalize_name(project)
+    for i, char in enumerate(stem):
+        if char == '-' and canonicalize_name(stem[:i]) == canonical:
+            return stem[:i], stem[i + 1:]
+    raise ValueError('{} does not match project {}'.format(filename, project))
+
+
+class Candidate:
+    """ A single distribution file of a project as listed by the index. """
+
+    __slots__ = ('name', 'version', 'filename', 'url', 'hashes', 'requires_python', 'yanked', 'wheel_tags',
+                 'metadata')
+
+    def __init__(self, name: str, version: Version, filename: str, url: str, hashes: Dict[str, str] = None,
+                 requires_python: str = None, yanked: bool = False, wheel_tags: FrozenSet[tags.Tag] = None,
+                 metadata: Dict[str, str] = None):
+        self.name = name
+        self.version = version
+        self.filename = filename
+        self.url = url
+        self.hashes = hashes or {}
+        self.requires_python = requires_python
+        self.yanked = yanked
+        self.wheel_tags = wheel_tags
+        # hashes of the PEP 658 core metadata file, `None` if the index does not provide one
+        self.metadata = metadata
+
+    @property
+    def is_wheel(self) -> bool:
+        return self.wheel_tags is not None
+
+    @property
+    def hash_name(self) -> Optional[str]:
+        for name in HASH_PREFERENCE:
+            if name in self.hashes:
+                return name
+        return next(iter(self.hashes), None)
+
+    @property
+    def hash(self) -> Optional[str]:
+        return self.hashes.get(self.hash_name, None)
+
+    def __repr__(self):
+        return '<Candidate {!r} {} ({})>'.format(self.name, self.version, self.filename)
+
+
+def _file_record(filename: str, url: str, hashes: Dict[str, str] = None,
+                 requires_python: str = None, yanked: bool = False, metadata: Dict[str, str] = None) -> Dict:
+    """ Plain (JSON serializable) representation of an index file entry. """
+    return {
+        'filename': filename,
+        'url': url,
+        'hashes': hashes or {},
+        'requires_python': requires_python,
+        'yanked': bool(yanked),
+        'metadata': metadata,
+    }
+
+
+def _html_metadata(value: Optional[str]) -> Optional[Dict[str, str]]:
+    """ Hashes of a PEP 658 `data-(dist-info|core)-metadata` attribute. """
+    if value is None:
+        return None
+    if '=' in value:
+        name, digest = value.split('=', 1)
+        return {name: digest}
+    return {}
+
+
+def _json_metadata(value) -> Optional[Dict[str, str]]:
+    """ Hashes of a PEP 691 `(dist-info|core)-metadata` key. """
+    if isinstance(value, dict):
+        return value
+    return {} if value else None
+
+
+class _AnchorParser(HTMLParser):
+
+    def __init__(self):
+        super().__init__()
+        self.base_url = None
+        self.anchors = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'base' and self.base_url is None:
+            self.base_url = dict(attrs).get('href', None)
+        elif tag == 'a':
+            attrs = dict(attrs)
+            if attrs.get('href', None):
+                self.anchors.append(attrs)
+
+
+def parse_html(body: str, page_url: str) -> List[Dict]:
+    """ Files listed on a PEP 503 HTML project page. """
+    parser = _AnchorParser()
+    parser.feed(body)
+    parser.close()
+    base_url = urljoin(page_url, parser.base_url) if parser.base_url else page_url
+
+    files = []
+    for anchor in parser.anchors:
+        url, fragment = urldefrag(urljoin(base_url, anchor['href']))
+        hashes = {}
+        if '=' in fragment:
+            name, value = fragment.split('=', 1)
+            hashes[name] = value
+        filename = unquote(urlsplit(url).path.rsplit('/', 1)[-1])
+        files.append(_file_record(
+            filename, url, hashes,
+            requires_python=anchor.get('data-requires-python', None),
+            yanked='data-yanked' in anchor,
+            # PEP 714 renamed the attribute, older indexes only serve the PEP 658 name
+            metadata=_html_metadata(anchor.get('data-core-metadata', anchor.get('data-dist-info-metadata', None))),
+        ))
+    return files
+
+
+def parse_json(data: Dict, page_url: str) -> List[Dict]:
+    """ Files listed on a PEP 691 JSON project page. """
+    files = []
+    for item in data.get('files', []):
+        files.append(_file_record(
+            item['filename'], urljoin(page_url, item['url']), item.get('hashes', {}),
+            requires_python=item.get('requires-python', None),
+            yanked=item.get('yanked', False),
+            metadata=_json_metadata(item.get('core-metadata', item.get('dist-info-metadata', None))),
+        ))
+    return files
+
+
+def parse_legacy_json(data: Dict, page_url: str) -> List[Dict]:
+    """ Files listed by the legacy `/pypi/<name>/json` endpoint. """
+    files = []
+    releases = data.get('releases', None)
+    if releases is None:
+        # per-version document
+        releases = {None: data.get('urls', [])}
+    for release_files in releases.values():
+        for item in release_files:
+            files.append(_file_record(
+                item['filename'], urljoin(page_url, item['url']), item.get('digests', {}),
+                requires_python=item.get('requires_python', None),
+                yanked=item.get('yanked', False),
+            ))
+    return files
+
+
+def parse_response(body: str, content_type: str, page_url: str) -> List[Dict]:
+    """ Files listed by an index response, dispatching on the negotiated content type. """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type == SIMPLE_JSON:
+        return parse_json(json.loads(body), page_url)
+    elif content_type == 'application/json':
+        return parse_legacy_json(json.loads(body), page_url)
+    return parse_html(body, page_url)
+
+
+def to_candidate(project: str, record: Dict,
+                 parse_version: Callable[[str], Optional[Version]] = Version) -> Optional[Candidate]:
+    """
+    Build a candidate from a file record, or `None` if the file is not a distribution of `project`
+    or `parse_version` rejects its version.
+    """
+    filename = record['filename']
+    wheel_tags = None
+    try:
+        if filename.endswith(WHEEL_EXTENSION):
+            parts = _split_wheel_filename(filename)
+            name, version = parts[0], parts[1]
+            if canonicalize_name(name) != canonicalize_name(project):
+                return None
+        else:
+            name, version = parse_sdist_filename(filename, project)
+        version = parse_version(version)
+        # tags are only parsed for files of versions that are of interest
+        if version is not None and filename.endswith(WHEEL_EXTENSION):
+            wheel_tags = tags.parse_tag('-'.join(parts[-3:]))
+    except (ValueError, InvalidVersion):
+        return None
+    if version is None:
+        return None
+
+    return Candidate(name, version, filename, record['url'], record['hashes'],
+                     record['requires_python'], record['yanked'], wheel_tags, record.get('metadata', None))
+
+
+# glibc versions of the legacy manylinux tags (PEP 513, PEP 571, PEP 599)
+LEGACY_MANYLINUX = {'manylinux1': (2, 5), 'manylinux2010': (2, 12), 'manylinux2014': (2, 17)}
+_MANYLINUX = re.compile(r'manylinux_(\d+)_(\d+)_(.+)$')
+_LEGACY_MANYLINUX = re.compile(r'(manylinux1|manylinux2010|manylinux2014)_(.+)$')
+_MUSLLINUX = re.compile(r'musllinux_(\d+)_(\d+)_(.+)$')
+
+
+def _expand_manylinux(major: int, minor: int, arch: str) -> List[str]:
+    """ Wheels for the same or an older glibc run on a manylinux platform (PEP 600), as in packaging's `_manylinux`. """
+    # the oldest glibc manylinux wheels exist for
+    oldest = 5 if arch in ['x86_64', 'i686'] else 17
+    platforms = []
+    for glibc_minor in range(minor, (oldest if major == 2 else 0) - 1, -1):
+        platforms.append('manylinux_{}_{}_{}'.format(major, glibc_minor, arch))
+        for legacy, glibc in LEGACY_MANYLINUX.items():
+            if glibc == (major, glibc_minor) and (legacy == 'manylinux2014' or arch in ['x86_64', 'i686']):
+                platforms.append('{}_{}'.format(legacy, arch))
+    return platforms
+
+
+def _expand_platform(platform: str) -> List[str]:
+    """
+    Platform tags of wheels accepted on a platform: older manylinux wheels are accepted on newer
+    manylinux platforms (PEP 600, and the legacy aliases of PEP 513, PEP 571 and PEP 599), older
+    musllinux wheels on newer musllinux platforms (PEP 656).
+    """
+    match = _MANYLINUX.match(platform)
+    if match:
+        return _expand_manylinux(int(match.group(1)), int(match.group(2)), match.group(3))
+    match = _LEGACY_MANYLINUX.match(platform)
+    if match:
+        major, minor = LEGACY_MANYLINUX[match.group(1)]
+        return _expand_manylinux(major, minor, match.group(2))
+    match = _MUSLLINUX.match(platform)
+    if match:
+        major, minor, arch = int(match.group(1)), int(match.group(2)), match.group(3)
+        return ['musllinux_{}_{}_{}'.format(major, m, arch) for m in range(minor, -1, -1)]
+    return [platform]
+
+
+def python_version_info(python_version: str) -> Tuple[int, ...]:
+    """ Parse a `python_version` option, accepting pip's `37` short form next to `3.7`. """
+    if '.' in python_version:
+        return tuple(int(x) for x in python_version.split('.'))
+    elif len(python_version) > 1:
+        return int(python_version[0]), int(python_version[1:])
+    return (int(python_version),)
+
+
+@lru_cache(maxsize=None)
+def supported_tags(platform: str = None, python_version: str = None, abis: Tuple[str, ...] = None,
+                   implementation: str = None) -> FrozenSet[tags.Tag]:
+    """
+    Wheel tags accepted for the given target, defaulting to the running interpreter
+    (like pip's `--platform`, `--python-version`, `--abi` and `--implementation`).
+
+    The set is built once per target, so that checking a wheel is a set lookup of its tags.
+    Needs packaging 21.3 or newer (as in the Pipfile): older releases tag Python 3.10 and
+    later as `cp3_10` instead of `cp310`.
+    """
+    version_info = python_version_info(python_version)[:2] if python_version else None
+    platforms = _expand_platform(platform) if platform else None
+    abis = list(abis) if abis else None
+
+    implementation = implementation or tags.interpreter_name()
+    if version_info:
+        interpreter = '{}{}'.format(implementation, ''.join(str(x) for x in version_info))
+    else:
+        interpreter = '{}{}'.format(implementation, tags.interpreter_version())
+
+    supported = []
+    if implementation == 'cp':
+        supported.extend(tags.cpython_tags(python_version=version_info, abis=abis, platforms=platforms))
+    else:
+        supported.extend(tags.generic_tags(interpreter=interpreter, abis=abis, platforms=platforms))
+    supported.extend(tags.compatible_tags(python_version=version_info, interpreter=interpreter, platforms=platforms))
+    return frozenset(supported)
@@ -0,0 +1,188 @@
+# Copyright (c) 2016-Present Pivotal Software, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import tarfile
+import zipfile
+from email.parser import HeaderParser
+from email.policy import compat32
+from typing import Dict, Optional
+
+RANGE_BLOCK_SIZE = 64 * 1024
+
+
+class RangeRequestsNotSupported(Exception):
+    pass
+
+
+def package_info(version, name, summary, home_page, platforms, requires_python) -> Dict:
+    """
+    The subset of package information that `common.get_package_info` provides, without the
+    `UNKNOWN` that distutils wrote for unset fields.
+    """
+    def known(value):
+        return None if value is None or value == 'UNKNOWN' else str(value)
+
+    return {
+        'version': known(version),
+        'metadata': {
+            'package_name': known(name),
+            'summary': known(summary),
+            'home_page': known(home_page),
+            'platforms': ', '.join(str(value) for value in platforms or [] if value != 'UNKNOWN'),
+            'requires_python': known(requires_python),
+        }
+    }
+
+
+def parse_metadata(data: bytes) -> Dict:
+    """ Parse core metadata (`METADATA`, `PKG-INFO` or a PEP 658 `.metadata` file) into `package_info`. """
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        # metadata of old distributions is not always UTF-8, pkginfo falls back the same way
+        text = data.decode('latin-1')
+    # parsed as text, compat32 returns non-ASCII values as `str` instead of `email.header.Header`
+    headers = HeaderParser(policy=compat32).parsestr(text)
+    return package_info(headers.get('Version', None), headers.get('Name', None), headers.get('Summary', None),
+                        headers.get('Home-page', None), headers.get_all('Platform', []),
+                        headers.get('Requires-Python', None))
+
+
+def read_wheel_metadata(fileobj) -> bytes:
+    """ Read `<name>.dist-info/METADATA` from a wheel, touching only the central directory and that member. """
+    with zipfile.ZipFile(fileobj) as wheel:
+        for name in wheel.namelist():
+            parts = name.split('/')
+            if len(parts) == 2 and parts[0].endswith('.dist-info') and parts[1] == 'METADATA':
+                return wheel.read(name)
+    raise ValueError('no .dist-info/METADATA found in wheel')
+
+
+def _is_sdist_pkg_info(name: str) -> bool:
+    """ Whether an archive member is the `PKG-INFO` of the sdist's top-level directory. """
+    parts = name.lstrip('./').split('/')
+    return len(parts) == 2 and parts[1] == 'PKG-INFO'
+
+
+def read_sdist_metadata(path: str) -> bytes:
+    """
+    Read the top-level `PKG-INFO` of an sdist. Tarballs are read as a stream that stops at
+    that member, zip files through their central directory.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if _is_sdist_pkg_info(name):
+                    return archive.read(name)
+    else:
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and _is_sdist_pkg_info(member.name):
+                    return archive.extractfile(member).read()
+    raise ValueError('no PKG-INFO found in {}'.format(os.path.basename(path)))
+
+
+def read_package_metadata(path: str) -> bytes:
+    """
+    Core metadata of a wheel, an sdist or an sdist unpacked into a directory (as `in` does),
+    reading as little of the file as its format allows.
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'PKG-INFO'), 'rb') as file:
+            return file.read()
+    if path.endswith('.whl'):
+        with open(path, 'rb') as file:
+            return read_wheel_metadata(file)
+    return read_sdist_metadata(path)
+
+
+class HttpRangeFile(io.RawIOBase):
+    """
+    Read-only, seekable file over HTTP range requests.
+
+    The tail of the file is fetched upfront since that is where zip archives keep their
+    central directory; further reads are fetched in blocks of at least `block_size`.
+    """
+
+    def __init__(self, session, url: str, timeout: float, block_size: int = RANGE_BLOCK_SIZE):
+        super().__init__()
+        self.session = session
+        self.timeout = timeout
+        self.block_size = block_size
+
+        response = session.head(url, allow_redirects=True, timeout=timeout, headers={'Accept-Encoding': 'identity'})
+        response.raise_for_status()
+        if response.headers.get('Accept-Ranges', None) != 'bytes' or 'Content-Length' not in response.headers:
+            raise RangeRequestsNotSupported(url)
+        self.url = response.url
+        self.length = int(response.headers['Content-Length'])
+        self.position = 0
+        self.bytes_fetched = 0
+        self._chunks = []
+        self._fetch(max(0, self.length - block_size), self.length)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.length + offset
+        else:
+            raise ValueError('invalid whence: {}'.format(whence))
+        return self.position
+
+    def read(self, size=-1):
+        start = self.position
+        end = self.length if size is None or size < 0 else min(self.length, start + size)
+        if start >= end:
+            return b''
+        data = self._cached(start, end)
+        if data is None:
+            data = self._fetch(start, min(self.length, max(end, start + self.block_size)))[:end - start]
+        self.position = end
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _cached(self, start: int, end: int) -> Optional[bytes]:
+        for chunk_start, chunk in self._chunks:
+            if chunk_start <= start and end <= chunk_start + len(chunk):
+                return chunk[start - chunk_start:end - chunk_start]
+        return None
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        headers = {'Range': 'bytes={}-{}'.format(start, end - 1), 'Accept-Encoding': 'identity'}
+        response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise RangeRequestsNotSupported(self.url)
+        data = response.content
+        self.bytes_fetched += len(data)
+        self._chunks.append((start, data))
+        return data
@@ -19,8 +19,18 @@ import json
 import os
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
-from . import common, pipio
+import requests
+
+from . import check, common, index, pipio, trace, upload, versioning
+from .retry import RetryPolicy, TransientError
+
+METADATA_WORKERS = 8
+# attempts to find an uploaded version in the index listing, for `source.version_artefact`
+LISTING_RETRIES = 6
+LISTING_DELAY = 2
 
 class VersionValidationError(Exception):
     pass
@@ -28,25 +38,141 @@ class VersionValidationError(Exception):
 class NamesValidationError(Exception):
     pass
 
+class UploadConflictError(Exception):
+    pass
+
+class VersionNotListedError(TransientError):
+    pass
 
-def find_package(pattern, srcdir):
+
+def filename_version(path: str, project: str = None) -> Optional[pipio.Version]:
+    """
+    Version of a distribution taken from its filename (PEP 427, PEP 625), or `None` if
+    the filename does not tell it unambiguously.
+    """
+    filename = os.path.basename(path)
+    try:
+        if filename.endswith(index.WHEEL_EXTENSION):
+            unused_name, version, unused_tags = index.parse_wheel_filename(filename)
+        else:
+            extension = index.sdist_extension(filename)
+            if not extension:
+                return None
+            stem = filename[:-len(extension)]
+            if stem.count('-') == 1:
+                unused_name, version = stem.split('-')
+            elif project:
+                # legacy sdist with dashes in the name
+                unused_name, version = index.parse_sdist_filename(filename, project)
+            else:
+                return None
+        return versioning.parse_version(version)
+    except (ValueError, pipio.InvalidVersion):
+        return None
+
+
+def _sort_key(version: str):
+    try:
+        return (1, versioning.parse_version(version))
+    except pipio.InvalidVersion:
+        return (0, version)
+
+
+def find_package(pattern, srcdir, project=None):
     files = glob.glob(os.path.join(srcdir, pattern))
     common.msg('Glob {} matched files: {}', pattern, files)
-    files = sorted(files, key=lambda x: common.get_package_info(x)['version'])
+
+    versions = {path: filename_version(path, project) for path in files}
+    ambiguous = [path for path, version in versions.items() if version is None]
+    if ambiguous:
+        # only open archives whose filename does not tell the version
+        common.msg('Reading metadata of {} files with ambiguous names', len(ambiguous))
+        with ThreadPoolExecutor(max_workers=min(METADATA_WORKERS, len(ambiguous))) as executor:
+            for path, pkg_info in zip(ambiguous, executor.map(trace.propagate(common.get_package_info), ambiguous)):
+                versions[path] = pkg_info['version']
+
+    files = sorted(files, key=lambda x: _sort_key(str(versions[x])))
     return files[-1]
 
 
+def is_uploaded(pkgpath, input, version: pipio.Version) -> bool:
+    """
+    Whether the index already has this very file, compared by the digest the index publishes.
+    Raises if it has a different file of the same name, which it would refuse to replace anyway.
+    """
+    filename = os.path.basename(pkgpath)
+    try:
+        with trace.span('find_uploaded', filename=filename) as span:
+            record = pipio.pip_find_file(input, filename, version)
+            span['found'] = record is not None
+    except requests.RequestException as e:
+        # e.g. an index that requires authentication while `repository.authenticate` is `out`
+        common.msg('Looking up {} on the index failed ({}), uploading it', filename, e)
+        return False
+    if not record:
+        return False
+
+    hash_name = next((name for name in index.HASH_PREFERENCE if name in record['hashes']), None)
+    if not hash_name:
+        common.msg('{} is listed by the index without a digest, uploading it again', filename)
+        return False
+    with trace.span('hash', path=pkgpath, hash_name=hash_name):
+        digest = upload.file_digest(pkgpath, hash_name)
+    if digest != record['hashes'][hash_name]:
+        raise UploadConflictError('{} already exists on the index with a different {} digest ({}, local file {})'
+                                  .format(filename, hash_name, record['hashes'][hash_name], digest))
+    return True
+
+
+def _list_uploaded(input, version: pipio.Version):
+    package_info = pipio.pip_get_versions(input, version=version)
+    if version not in package_info:
+        raise VersionNotListedError('version {} is not listed by the index yet'.format(version))
+    return package_info
+
+
+def uploaded_version(input, version: str):
+    """
+    The version to report for an upload. With `source.version_artefact` it carries the same
+    artefact `check` reports, taken from the index listing, so Concourse sees one version.
+    """
+    if not input['source'].get('version_artefact', False):
+        return {'version': version}
+    version = versioning.parse_version(version)
+    policy = RetryPolicy(LISTING_RETRIES, LISTING_DELAY)
+    try:
+        with trace.span('list_uploaded', version=str(version)):
+            package_info = policy.call(_list_uploaded, input, version, stage='list uploaded version')
+    except VersionNotListedError:
+        common.msg('Version {} is not listed by the index (or does not match the selection), '
+                   'reporting it without its artefact', version)
+        return {'version': str(version)}
+    return check.version_dict(input, version, package_info)
+
+
 def upload_package(pkgpath, input):
     repocfg = input['source']['repository']
-    twine_cmd = [sys.executable, '-m', 'twine', 'upload']
-
-    url, unused_hostname = pipio.get_pypi_url(input, 'out')
 
     username = repocfg.get('username', os.getenv('TWINE_USERNAME'))
     password = repocfg.get('password', os.getenv('TWINE_PASSWORD'))
     if not (username and password):
         raise KeyError("username and password required to upload")
 
+    params = input.get('params', {})
+    uploader = params.get('uploader', 'internal')
+    with trace.span('upload', path=pkgpath, uploader=uploader, bytes=os.path.getsize(pkgpath)):
+        if uploader == 'twine':
+            upload_package_twine(pkgpath, input, username, password)
+        else:
+            upload.upload(pkgpath, common.get_package_metadata(pkgpath), repocfg['repository_url'], username, password,
+                          chunk_size=params.get('upload_chunk_size', upload.CHUNK_SIZE))
+
+
+def upload_package_twine(pkgpath, input, username, password):
+    twine_cmd = [sys.executable, '-m', 'twine', 'upload']
+
+    url, unused_hostname = pipio.get_pypi_url(input, 'out')
+
     twine_cmd.append(pkgpath)
 
     env = os.environ.copy()
@@ -68,34 +194,44 @@ def upload_package(pkgpath, input):
 
 
 def out(srcdir, input):
-    common.merge_defaults(input)
-
-    common.msg('Finding package to upload')
-    pkgpath = find_package(input['params']['glob'], srcdir)
-    response = common.get_package_info(pkgpath)
-    version = str(response['version'])
-
-    common.msg('Check that the package name = input name')
-    package_name = str(response['metadata']['package_name'])
-    input_name = str(input['source']['name'])
-    name_must_match = input['source']['name_must_match']
-    if name_must_match and package_name != input_name:
-        raise NamesValidationError(
-            f"Different names for package ({package_name}) and input ({input_name}). If this is intentional, you can configure `name_must_match` to `false`."
-        )
-
-    try:
-        pipio.Version(version)
-    except pipio.InvalidVersion:
-        raise VersionValidationError(
-            f"Version {version} string is not compliant with PEP 440 versioning convention.",
-            "See https://peps.python.org/pep-0440 for more details."
-        )
-
-    common.msg('Uploading {} version {}', pkgpath, version)
-    upload_package(pkgpath, input)
-
-    return {'version': {'version': version}}
+    trace.configure(input)
+    with trace.span('out'):
+        with trace.span('merge_defaults'):
+            common.merge_defaults(input)
+
+        common.msg('Finding package to upload')
+        with trace.span('find_package'):
+            pkgpath = find_package(input['params']['glob'], srcdir, input['source'].get('name', None))
+        response = common.get_package_info(pkgpath)
+        version = str(response['version'])
+
+        common.msg('Check that the package name = input name')
+        package_name = str(response['metadata']['package_name'])
+        input_name = str(input['source']['name'])
+        name_must_match = input['source']['name_must_match']
+        if name_must_match and package_name != input_name:
+            raise NamesValidationError(
+                f"Different names for package ({package_name}) and input ({input_name}). If this is intentional, you can configure `name_must_match` to `false`."
+            )
+
+        try:
+            pipio.Version(version)
+        except pipio.InvalidVersion:
+            raise VersionValidationError(
+                f"Version {version} string is not compliant with PEP 440 versioning convention.",
+                "See https://peps.python.org/pep-0440 for more details."
+            )
+
+        if input.get('params', {}).get('skip_existing', False) and is_uploaded(pkgpath, input,
+                                                                                 versioning.parse_version(version)):
+            common.msg('{} version {} has already been uploaded, skipping it', pkgpath, version)
+        else:
+            common.msg('Uploading {} version {}', pkgpath, version)
+            upload_package(pkgpath, input)
+
+        response_version = uploaded_version(input, version)
+
+    return {'version': response_version}
 
 
 def main():
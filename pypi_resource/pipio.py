@@ -10,106 +10,115 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import requests
+import hashlib
+import json
+import os
 import shutil
-import sys
-import tempfile
-from contextlib import redirect_stdout
-from typing import Dict, List, Tuple
-from urllib.parse import urlsplit, urlunsplit
-
-from pip._internal.commands.download import DownloadCommand as PipDownloadCommand
-from pip._internal.network.download import Downloader
-from pip._internal.network.session import PipSession
-from pip._internal.operations.prepare import unpack_url
-from pip._internal.models.candidate import InstallationCandidate
-from pip._internal.models.link import Link
-from pip._internal.models.target_python import TargetPython
-from pip._internal.cli.status_codes import SUCCESS
-from pip._internal.utils.temp_dir import global_tempdir_manager
-from pip._vendor.packaging.version import Version, InvalidVersion # for other files
-
-from . import common
-
-TIMEOUT = 15
-RETRIES = 5
-
-
-class ListVersionsCommand(PipDownloadCommand):
-
-    def __init__(self, *args, **kw):
-        super(ListVersionsCommand, self).__init__(*args, **kw)
-
-    def run(self, options, args):
-        options.timeout = TIMEOUT
-        options.retries = RETRIES
-        options.ignore_installed = True
-        options.editables = []
-
-        with self._build_session(options) as session:
-            finder = self._build_package_finder(
-                options=options,
-                session=session,
-                target_python = TargetPython(
-                    platform=options.platform,
-                    py_version_info=options.python_version,
-                    abi=options.abi,
-                    implementation=options.implementation,
-                ),
-            )
-
-            requirement_set = self.get_requirements(
-                args,
-                options,
-                finder,
-                session,
-            )
-
-            candidates = []
-            for req in requirement_set:
-                # extract from finder.find_requirement
-                all_candidates = finder.find_all_candidates(req.name)
-                candidates.extend(all_candidates)
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit, urlunsplit
 
-        self.candidates = candidates
-        return SUCCESS
-
-
-def _input_to_download_args(resconfig, destdir=None) -> List[str]:
-    """ Build pip download args from a resource configuration. """
-
-    package_name = resconfig['source']['name']
-    package_version = resconfig['version']['version']
-
-    args = ['--no-deps', ]
-
-    # TODO:
-    # abi
-    # implementation
-    if resconfig['source']['pre_release']:
-        args.append('--pre')
-
-    if resconfig['source'].get('platform'):
-        args.extend(['--platform', resconfig['source']['platform']])
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase, HTTPBasicAuth
+from urllib3.util.retry import Retry
 
-    if resconfig['source']['packaging'] == 'source':
-        args.extend(['--no-binary', ':all:'])
-    elif resconfig['source']['packaging'] == 'binary':
-        args.extend(['--only-binary', ':all:'])
+from packaging.version import Version, InvalidVersion # for other files
 
-    if resconfig['source']['python_version']:
-        args.extend(['--python-version', resconfig['source']['python_version']])
+from . import common, filters, index, metadata, trace
+from .hashing import HashingPipeline
+from .retry import RetryPolicy
+from .cache import DEFAULT_ARTEFACT_CACHE_SIZE, DEFAULT_INDEX_CACHE_SIZE, ArtefactCache, IndexCache
 
-    if destdir:
-        args.extend(['--dest', destdir])
+TIMEOUT = 15
+RETRIES = 5
+CHUNK_SIZE = 1024 * 1024
+POOL_SIZE = 10
+
+
+class HashMismatchError(Exception):
+    pass
+
+
+class IndexAuth(AuthBase):
+    """
+    Basic authentication limited to the index host.
+
+    Credentials are sent upfront if `authenticate` covers downloads, otherwise only in
+    reply to a 401 challenge (as pip did). Other hosts, e.g. a CDN serving the files,
+    never see them.
+    """
+
+    def __init__(self, netloc: str, username: str, password: str, preemptive: bool):
+        self.netloc = netloc
+        self.basic = HTTPBasicAuth(username or '', password or '')
+        self.preemptive = preemptive
+
+    def __call__(self, request):
+        if urlsplit(request.url)[1] == self.netloc:
+            if self.preemptive:
+                return self.basic(request)
+            request.register_hook('response', self._handle_401)
+        return request
+
+    def _handle_401(self, response, **kwargs):
+        if response.status_code != 401:
+            return response
+        # consume content and release the original connection
+        response.content
+        response.close()
+        request = self.basic(response.request.copy())
+        retry = response.connection.send(request, **kwargs)
+        retry.history.append(response)
+        retry.request = request
+        return retry
+
+
+class _IndexHostAdapter(HTTPAdapter):
+    """ Applies `repository.verify` to the index host only, like pip's `--trusted-host`. """
+
+    def __init__(self, verify, **kwargs):
+        self.verify = verify
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        kwargs['verify'] = self.verify
+        return super().send(request, **kwargs)
+
+
+def _build_session(resconfig, pool_size: int = None) -> requests.Session:
+    repocfg = resconfig['source']['repository']
+    session = requests.Session()
+    pool_size = pool_size or resconfig['source'].get('http_pool_size', POOL_SIZE)
+    # only failed connections are retried here, error responses are left to the RetryPolicy of a stage
+    retries = Retry(total=RETRIES, backoff_factor=0.25)
+    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    verify = repocfg.get('verify', True)
+    if verify is not True:
+        # e.g. a private index with a self-signed certificate
+        session.mount('https://{}/'.format(urlsplit(repocfg['index_url'])[1]),
+                      _IndexHostAdapter(verify, pool_maxsize=pool_size, max_retries=retries))
+    if repocfg.get('username', None):
+        session.auth = IndexAuth(
+            urlsplit(repocfg['index_url'])[1],
+            repocfg['username'],
+            repocfg.get('password', None),
+            preemptive=repocfg['authenticate'] in ['in', 'always'],
+        )
+    return session
 
-    if 'index_url' in resconfig['source']['repository']:
-        url, hostname = get_pypi_url(resconfig, kind='index')
-        args.extend(['--index-url', url,
-                     '--trusted-host', hostname])
 
-    args.append(package_name + ('=={}'.format(package_version) if package_version else ''))
-    return args
+def open_session(resconfig, workers: int = 1) -> requests.Session:
+    """
+    Session to share between listing, metadata and download requests of one invocation, so
+    that connections (and their TLS handshakes) and the auth setup are reused.
+    """
+    return _build_session(resconfig, max(workers, resconfig['source'].get('http_pool_size', POOL_SIZE)))
 
 
 def get_pypi_url(input, mode='in', kind='repository') -> Tuple[str, str]:
@@ -135,67 +144,137 @@ def get_pypi_url(input, mode='in', kind='repository') -> Tuple[str, str]:
     return url, hostname
 
 
-def _candidate_to_package_info_artefact(candidate: InstallationCandidate) -> Dict[str, str]:
+def _candidate_to_package_info_artefact(candidate: index.Candidate) -> Dict[str, str]:
     """ Provide artifact metadata """
-    loc = candidate.link
     artefact = {
-        'filename': loc.filename,
-        'hash': '{}:{}'.format(loc.hash_name, loc.hash),
-        'url': loc.url,
+        'filename': candidate.filename,
+        'hash': '{}:{}'.format(candidate.hash_name, candidate.hash),
+        'url': candidate.url,
     }
+    if candidate.metadata is not None:
+        # PEP 658 metadata file, possibly without a hash
+        hash_name = next((name for name in index.HASH_PREFERENCE if name in candidate.metadata), None)
+        artefact['core_metadata'] = '{}:{}'.format(hash_name, candidate.metadata[hash_name]) if hash_name else ''
     return artefact
 
 
-def _pip_query_pypi_json(resconfig):
-    package_name = resconfig['source']['name']
-    index_url, unused_hostname = get_pypi_url(resconfig)
-    url = '{}/{}/json'.format(index_url, package_name)
-
-    response = requests.get(url)
-    if response.ok:
-        candidates = []
-        data = response.json()
-        for version, release_artefacts in data['releases'].items():
-            for release in release_artefacts:
-                candidates.append(InstallationCandidate(package_name, version, Link(release['url'])))
-        return candidates
-
-    return None
-
-
-def _pip_query_candidates(resconfig) -> List[InstallationCandidate]:
-    args = _input_to_download_args(resconfig)
-
-    with redirect_stdout(sys.stderr):
-        cmd = ListVersionsCommand('list versions', 'list versions')
-        rc = cmd.main(args)
-        # pip 10.0.1 returns 0 even on connection problems, which get output to stderr
-        # but cannot be clearly distinguished from a successful 'not found'.
-        if rc == 0:
-            candidates = cmd.candidates
-        else:
-            common.msg("List Versions returned {}", rc)
-            candidates = []
-
-    return candidates
-
-
-def pip_get_versions(resconfig) -> Dict[str, dict]:
-    # JSON protocol query as used in version 0.2.0 could still be used here,
-    # but does not include mechanisms of filtering (platform, abi, python_version,
-    # packaging) that pip includes.
-    # candidates = _pip_query_pypi_json(resconfig)
-    candidates = _pip_query_candidates(resconfig)
-
-    if resconfig['source'].get('filename_match', None):
-        matchstr = resconfig['source']['filename_match']
-        candidates = filter(lambda x: matchstr in x.link.filename, candidates)
-
-    if not resconfig['source']['pre_release']:
-        candidates = filter(lambda x: not (x.version.is_prerelease or x.version.is_devrelease), candidates)
-
-    if not resconfig['source']['release']:
-        candidates = filter(lambda x: (x.version.is_prerelease or x.version.is_devrelease), candidates)
+def _index_cache(resconfig) -> Optional[IndexCache]:
+    directory = resconfig['source'].get('index_cache_dir', None)
+    if not directory:
+        return None
+    max_size = resconfig['source'].get('index_cache_max_size', DEFAULT_INDEX_CACHE_SIZE)
+    return IndexCache(directory, max_size)
+
+
+def _index_request_url(resconfig, version: Version = None) -> str:
+    """ Index url listing the files of the package, only those of `version` if the index API allows it. """
+    repocfg = resconfig['source']['repository']
+    if repocfg['index_api'] == 'json':
+        return index.legacy_json_url(repocfg['index_url'], resconfig['source']['name'], version and str(version))
+    return index.project_url(repocfg['index_url'], resconfig['source']['name'])
+
+
+def _fetch_index_files(resconfig, session: requests.Session, version: Version = None) -> List[Dict]:
+    """
+    Fetch the files listed for a package, revalidating a cached copy of the index page if configured.
+
+    The result does not depend on any of the selection options, so resources watching the
+    same package on the same index share one cache entry. Within `index_cache_ttl` seconds
+    the entry is used without asking the index at all.
+    """
+    url = _index_request_url(resconfig, version)
+    cache = _index_cache(resconfig)
+    if not cache:
+        return _request_index_files(resconfig, session, url, None, None)
+
+    ttl = resconfig['source'].get('index_cache_ttl', 0)
+    if not ttl:
+        return _request_index_files(resconfig, session, url, cache, cache.get(url))
+
+    # resources polling concurrently wait for the first one to refresh the entry
+    with cache.lock(url):
+        entry = cache.get(url)
+        if entry and 0 <= time.time() - entry.get('fetched_at', 0) < ttl:
+            common.msg("Using index page {} cached {:.0f}s ago", url, time.time() - entry['fetched_at'])
+            return entry['files']
+        return _request_index_files(resconfig, session, url, cache, entry)
+
+
+def _request_index_files(resconfig, session: requests.Session, url: str,
+                         cache: Optional[IndexCache], entry: Optional[Dict]) -> List[Dict]:
+    headers = {'Accept': index.ACCEPT}
+    headers.update(IndexCache.conditional_headers(entry))
+    with trace.span('index.fetch', url=url, conditional=bool(entry)) as span:
+        response = session.get(url, headers=headers, timeout=TIMEOUT)
+        span.update(status_code=response.status_code, bytes=len(response.content))
+
+    if response.status_code == 304 and entry:
+        common.msg("Index page {} not modified, using {} cached files", url, len(entry['files']))
+        if resconfig['source'].get('index_cache_ttl', 0):
+            cache.put(url, dict(entry, fetched_at=time.time()))
+        return entry['files']
+    if response.status_code == 404:
+        common.msg("Package {} not found at {}", resconfig['source']['name'], url)
+        return []
+    response.raise_for_status()
+
+    content_type = response.headers.get('Content-Type', None)
+    with trace.span('index.parse', content_type=content_type) as span:
+        files = index.parse_response(response.text, content_type, response.url)
+        span['files'] = len(files)
+    if cache:
+        cache.put(url, {
+            'etag': response.headers.get('ETag', None),
+            'last_modified': response.headers.get('Last-Modified', None),
+            'content_type': content_type,
+            'fetched_at': time.time(),
+            'body': response.text,
+            'files': files,
+        })
+    return files
+
+
+def _query_candidates(resconfig, session: requests.Session = None,
+                      candidate_filter: filters.CandidateFilter = None) -> List[index.Candidate]:
+    """
+    Distributions of the package listed by the index. With a `candidate_filter`, files it rejects
+    by filename or version are skipped before a candidate is built for them, and only the files of
+    its pinned version are requested if the index API allows it.
+    """
+    if session is None:
+        with _build_session(resconfig) as session:
+            return _query_candidates(resconfig, session, candidate_filter)
+
+    files = _fetch_index_files(resconfig, session, candidate_filter.version if candidate_filter else None)
+    project = resconfig['source']['name']
+    if candidate_filter is None:
+        candidates = (index.to_candidate(project, record) for record in files)
+    else:
+        candidates = (index.to_candidate(project, record, candidate_filter.parse_version) for record in files
+                      if candidate_filter.accepts_filename(record['filename']))
+    return [candidate for candidate in candidates if candidate]
+
+
+def filter_candidates(resconfig, candidates: List[index.Candidate],
+                      candidate_filter: filters.CandidateFilter = None) -> List[index.Candidate]:
+    """ Apply the selection options of a resource to the candidates listed by the index. """
+    candidate_filter = candidate_filter or filters.CandidateFilter(resconfig)
+    return [candidate for candidate in candidates if candidate_filter.accepts(candidate)]
+
+
+def pip_get_versions(resconfig, session: requests.Session = None, min_version: Version = None,
+                     version: Version = None) -> Dict[str, dict]:
+    """
+    Matching versions and their artefacts; versions below `min_version` or, if given,
+    other than `version` are skipped early.
+    """
+    candidate_filter = filters.CandidateFilter(resconfig, min_version, version)
+    with trace.span('list_candidates') as span:
+        candidates = _query_candidates(resconfig, session, candidate_filter)
+        span['candidates'] = len(candidates)
+    with trace.span('filter_candidates') as span:
+        candidates = filter_candidates(resconfig, candidates, candidate_filter)
+        span['candidates'] = len(candidates)
 
     versions = dict()
     for candidate in candidates:
@@ -213,22 +292,287 @@ def pip_get_versions(resconfig) -> Dict[str, dict]:
     return versions
 
 
-def pip_download_link(resconfig, url: str, destdir: str):
-    with redirect_stdout(sys.stderr):
-
-        netloc = urlsplit(resconfig['source']['repository']['index_url'])[1]
-        hostname = netloc.split(':')[0]
-        with PipSession(retries=RETRIES, trusted_hosts=[hostname, ]) as session:
-            session.timeout = TIMEOUT
-            session.auth.prompting = False
-            session.auth.passwords[netloc] = (resconfig['source']['repository'].get('username', None),
-                                              resconfig['source']['repository'].get('password', None))
-            # pip internals hardcode global tempdir manager.
-            # need to copy to destdir before tempdir gets blown away.
-            with global_tempdir_manager():
-                file = unpack_url(
-                    Link(url),
-                    destdir,
-                    Downloader(session, "pretty"),
-                )
-                shutil.copy(file.path, destdir)
+def pip_find_file(resconfig, filename: str, version: Version, session: requests.Session = None) -> Optional[Dict]:
+    """
+    The index record (url, hashes, ...) of `filename` if the index lists it for `version`,
+    regardless of the selection options.
+    """
+    if session is None:
+        with _build_session(resconfig) as session:
+            return pip_find_file(resconfig, filename, version, session)
+
+    for record in _fetch_index_files(resconfig, session, version):
+        if record['filename'] == filename:
+            return record
+    return None
+
+
+def _split_hash(artefact_hash: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """ Split an artefact hash `<name>:<hexdigest>` as produced for the version metadata. """
+    if artefact_hash and ':' in artefact_hash:
+        name, digest = artefact_hash.split(':', 1)
+        if name in hashlib.algorithms_available and digest and digest != 'None':
+            return name, digest
+    return None, None
+
+
+def _leading_dir(names: List[str]) -> Optional[str]:
+    """ Top-level directory shared by all archive members, if any. """
+    prefix = None
+    for name in names:
+        first = name.lstrip('/').split('/', 1)[0]
+        if not first or (prefix is not None and first != prefix):
+            return None
+        prefix = first
+    return prefix
+
+
+def _member_target(destdir: str, name: str, leading_dir: Optional[str]) -> Optional[str]:
+    name = name.lstrip('/')
+    if leading_dir:
+        name = name[len(leading_dir):].lstrip('/')
+    if not name:
+        return None
+    target = os.path.realpath(os.path.join(destdir, name))
+    if os.path.commonpath([target, os.path.realpath(destdir)]) != os.path.realpath(destdir):
+        raise ValueError('archive member {} would be extracted outside of {}'.format(name, destdir))
+    return target
+
+
+def unpack_archive(path: str, destdir: str):
+    """ Unpack a downloaded sdist next to it without its top-level directory, as pip's `unpack_url` used to. """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            leading_dir = _leading_dir(archive.namelist())
+            for info in archive.infolist():
+                target = _member_target(destdir, info.filename, leading_dir)
+                if not target:
+                    continue
+                if info.is_dir():
+                    os.makedirs(target, exist_ok=True)
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with archive.open(info) as src, open(target, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            members = archive.getmembers()
+            leading_dir = _leading_dir([m.name for m in members])
+            for member in members:
+                target = _member_target(destdir, member.name, leading_dir)
+                if not target:
+                    continue
+                if member.isdir():
+                    os.makedirs(target, exist_ok=True)
+                elif member.isfile():
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with archive.extractfile(member) as src, open(target, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+                    os.chmod(target, member.mode & 0o777 | 0o600)
+                else:
+                    common.msg("Skipping archive member {} of unsupported type", member.name)
+
+
+def _resume_state(partpath: str, url: str) -> Tuple[int, Optional[str]]:
+    """ Size and validator (ETag or Last-Modified) of a partial download of `url` left by a previous attempt. """
+    try:
+        with open(partpath + '.json', 'r') as file:
+            state = json.load(file)
+        if state.get('url') == url and state.get('validator'):
+            return os.path.getsize(partpath), state['validator']
+    except (OSError, ValueError):
+        pass
+    return 0, None
+
+
+def _save_resume_state(partpath: str, url: str, response: requests.Response):
+    """ Remember the validator of a response so that an interrupted download can be resumed with `If-Range`. """
+    etag = response.headers.get('ETag', None)
+    # weak validators must not be used for range requests
+    validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified', None)
+    if validator and response.headers.get('Accept-Ranges', None) == 'bytes':
+        with open(partpath + '.json', 'w') as file:
+            json.dump({'url': url, 'validator': validator}, file)
+
+
+def _remove_partial(partpath: str):
+    for path in [partpath, partpath + '.json']:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _download(session: requests.Session, url: str, path: str, hash_name: Optional[str], expected: Optional[str]):
+    """ Transfer `url` to `path` through a resumable `.part` file, verifying the digest. """
+    filename = os.path.basename(path)
+    partpath = path + '.part'
+    offset, validator = _resume_state(partpath, url)
+    # identity encoding, so that the bytes on disk are the ones the digest was taken of
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers.update({'Range': 'bytes={}-'.format(offset), 'If-Range': validator})
+
+    try:
+        with trace.span('download', url=url, offset=offset) as span, \
+                session.get(url, stream=True, timeout=TIMEOUT, headers=headers) as response:
+            if response.status_code == 416:
+                # the partial file is not a prefix of the current file, start over
+                _remove_partial(partpath)
+                return _download(session, url, path, hash_name, expected)
+            response.raise_for_status()
+            if offset and response.status_code == 206:
+                common.msg("Resuming download of {} at {} bytes", filename, offset)
+            else:
+                offset = 0
+                _save_resume_state(partpath, url, response)
+
+            # the digest is computed on another thread while the next chunk arrives
+            with HashingPipeline({hash_name: hashlib.new(hash_name)} if hash_name else {}) as hasher, \
+                    open(partpath, 'r+b' if offset else 'wb') as file:
+                if offset:
+                    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                        hasher.update(chunk)
+                file.seek(offset)
+                file.truncate()
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+                    hasher.update(chunk)
+                span['bytes'] = file.tell() - offset
+            digest = hasher.hexdigests().get(hash_name, None)
+
+        if hash_name and digest != expected:
+            _remove_partial(partpath)
+            if offset:
+                common.msg("Digest of resumed download of {} does not match, downloading it again", filename)
+                return _download(session, url, path, hash_name, expected)
+            raise HashMismatchError('{} digest of {} is {}, the index advertised {}'.format(
+                hash_name, filename, digest, expected))
+        os.replace(partpath, path)
+        _remove_partial(partpath)
+    except BaseException:
+        # keep what arrived for the next attempt, unless there is no way to resume it
+        if not _resume_state(partpath, url)[1]:
+            _remove_partial(partpath)
+        raise
+    common.msg("Downloaded {} ({} bytes)", filename, os.path.getsize(path))
+
+
+def _artefact_cache(resconfig) -> Optional[ArtefactCache]:
+    directory = resconfig['source'].get('artefact_cache_dir', None)
+    if not directory:
+        return None
+    return ArtefactCache(directory, resconfig['source'].get('artefact_cache_max_size', DEFAULT_ARTEFACT_CACHE_SIZE))
+
+
+def pip_download_link(resconfig, url: str, destdir: str, artefact_hash: str = None,
+                      session: requests.Session = None, unpack: bool = True) -> str:
+    """
+    Stream `url` straight into `destdir`, verifying `artefact_hash` while the bytes arrive.
+
+    The download goes to a `.part` file that is renamed into place once the digest
+    matched, so a failed or tampered download never shows up under its final name.
+    If an attempt is interrupted, the `.part` file is kept and the next attempt asks the
+    index for the remaining bytes only (`Range` with `If-Range`, so a file changed in
+    between is downloaded from the start).
+
+    With `artefact_cache_dir` configured, artefacts with a known digest are taken from
+    (or added to) the artefact cache instead. An sdist is unpacked into `destdir` unless
+    `unpack` is false.
+    """
+    filename = unquote(urlsplit(url).path.rsplit('/', 1)[-1])
+    path = os.path.join(destdir, filename)
+    hash_name, expected = _split_hash(artefact_hash)
+
+    if session is None:
+        with _build_session(resconfig) as session:
+            return pip_download_link(resconfig, url, destdir, artefact_hash, session, unpack)
+
+    artefact_cache = _artefact_cache(resconfig) if hash_name else None
+    if artefact_cache:
+        # concurrent resources wait for the first one to download the artefact
+        with artefact_cache.lock(hash_name, expected):
+            with trace.span('artefact_cache.get', filename=filename) as span:
+                method = artefact_cache.get(hash_name, expected, path)
+                span['method'] = method
+            if method:
+                common.msg("Using {} from the artefact cache ({})", filename, method)
+            else:
+                _download(session, url, path, hash_name, expected)
+                artefact_cache.put(hash_name, expected, path)
+    else:
+        _download(session, url, path, hash_name, expected)
+
+    if unpack:
+        _unpack_sdist(path, destdir)
+    return path
+
+
+def _unpack_sdist(path: str, destdir: str):
+    # pip unpacked sdists (but not wheels) into destdir, which `in` relies on for metadata
+    if not path.endswith(index.WHEEL_EXTENSION):
+        with trace.span('unpack', path=path):
+            unpack_archive(path, destdir)
+
+
+def pip_fetch_metadata(resconfig, artefact: Dict, session: requests.Session = None) -> Optional[bytes]:
+    """
+    Fetch the core metadata of an artefact without downloading it: the PEP 658 `.metadata`
+    file if the index serves one, otherwise the METADATA member of a wheel read through
+    HTTP range requests. Returns `None` if neither is available.
+    """
+    if session is None:
+        with _build_session(resconfig) as session:
+            return pip_fetch_metadata(resconfig, artefact, session)
+
+    if 'core_metadata' in artefact:
+        with trace.span('metadata.fetch', url=artefact['url'] + '.metadata') as span:
+            response = session.get(artefact['url'] + '.metadata', timeout=TIMEOUT)
+            span.update(status_code=response.status_code, bytes=len(response.content))
+        if response.ok:
+            data = response.content
+            hash_name, expected = _split_hash(artefact['core_metadata'])
+            if hash_name and hashlib.new(hash_name, data).hexdigest() != expected:
+                raise HashMismatchError('{} digest of {}.metadata does not match the index'.format(
+                    hash_name, artefact['filename']))
+            return data
+        common.msg("Fetching {}.metadata failed with {}", artefact['filename'], response.status_code)
+
+    if artefact['filename'].endswith(index.WHEEL_EXTENSION):
+        try:
+            with trace.span('metadata.range_read', url=artefact['url']) as span:
+                rangefile = metadata.HttpRangeFile(session, artefact['url'], TIMEOUT)
+                data = metadata.read_wheel_metadata(rangefile)
+                span['bytes'] = rangefile.bytes_fetched
+            common.msg("Read metadata of {} with {} of {} bytes", artefact['filename'],
+                       rangefile.bytes_fetched, rangefile.length)
+            return data
+        except metadata.RangeRequestsNotSupported:
+            common.msg("Index does not support range requests for {}", artefact['filename'])
+
+    return None
+
+
+def pip_download_links(resconfig, artefacts: List[Dict], destdir: str, workers: int,
+                       policy: RetryPolicy = None, session: requests.Session = None) -> List[str]:
+    """
+    Download several artefacts concurrently over one shared session, retrying each one on its own.
+    A given `session` should have a connection pool of at least `workers` connections.
+
+    Sdists share `destdir`, so they are unpacked one after the other once all downloads are done.
+    """
+    workers = max(1, min(workers, len(artefacts)))
+    if session is None:
+        with open_session(resconfig, workers) as session:
+            return pip_download_links(resconfig, artefacts, destdir, workers, policy, session)
+
+    policy = policy or RetryPolicy(count=1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(trace.propagate(policy.call), pip_download_link,
+                            resconfig, artefact['url'], destdir, artefact['hash'], session, unpack=False,
+                            stage='download ' + artefact['filename'])
+            for artefact in artefacts
+        ]
+        paths = [future.result() for future in futures]
+    for path in paths:
+        _unpack_sdist(path, destdir)
+    return paths
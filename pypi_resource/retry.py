@@ -1,25 +1,96 @@
+import email.utils
+import random
 import time
+from typing import Optional
 
-from . import common
+import requests
 
+from . import common, trace
 
-def retry_wrapper(count=3, delay_in_seconds=1):
+# status codes worth another attempt, anything else in 4xx is a permanent error
+TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504, 520, 522, 524, 527}
+MAX_RETRY_AFTER = 300
+
+
+class TransientError(Exception):
+    """ Raised for conditions that may resolve by themselves, e.g. a release not listed by the index yet. """
+    pass
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, TransientError):
+        return True
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in TRANSIENT_STATUS
+    # connection errors, timeouts, connections closed in the middle of a response and
+    # retries of a session adapter that ran out
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                              requests.exceptions.RetryError))
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """ Seconds to wait as requested by the `Retry-After` header of a 429 or 503 response. """
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After', None) if response is not None else None
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), MAX_RETRY_AFTER)
+
+
+class RetryPolicy:
+    """
+    Retry transient errors with capped exponential backoff.
+
+    The n-th retry waits between half and all of `delay * 2 ** (n - 1)` (at most `max_delay`),
+    so resources failing at the same time spread their retries instead of hitting the
+    index in lockstep. A `Retry-After` header takes precedence over the backoff.
+    Permanent errors are raised on the first attempt.
+    """
+
+    def __init__(self, count: int = 3, delay: float = 1, max_delay: float = 30):
+        self.count = max(1, count)
+        self.delay = delay
+        self.max_delay = max(delay, max_delay)
+
+    def backoff(self, attempt: int) -> float:
+        ceiling = min(self.max_delay, self.delay * 2 ** (attempt - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def call(self, function, *args, stage: str = None, **kwargs):
+        stage = stage or getattr(function, '__name__', repr(function))
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with trace.span('retry.attempt', stage=stage, attempt=attempt, count=self.count):
+                    return function(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                if attempt >= self.count:
+                    common.msg("-- {} failed after {} attempts", stage, attempt)
+                    raise
+                wait = retry_after(e)
+                if wait is None:
+                    wait = self.backoff(attempt)
+                common.msg("Attempt {} of {} to {} failed with {}: {}, retrying in {:.1f}s",
+                           attempt, self.count, stage, type(e).__name__, e, wait)
+                time.sleep(wait)
+
+
+def retry_wrapper(count=3, delay_in_seconds=1, max_delay_in_seconds=30):
     def decorator(function):
+        policy = RetryPolicy(count, delay_in_seconds, max_delay_in_seconds)
+
         def wrapper(*args, **kwargs):
-            tries = 0
-            while True:
-                try:
-                    tries += 1
-                    common.msg("Try %d of %d to call function `%s` from module `%s`" %
-                          (tries, count, function.__name__, function.__module__))
-                    result = function(*args, **kwargs)
-                    return result
-                except Exception as e:
-                    if tries >= count:
-                        common.msg("-- Failed retrying after %d tries with a %f second delay" %
-                              (tries, delay_in_seconds))
-                        raise e
-                    time.sleep(delay_in_seconds)
+            return policy.call(function, *args, **kwargs)
 
         return wrapper
 
@@ -0,0 +1,122 @@
+# Copyright (c) 2016-Present Pivotal Software, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Opt-in timing traces of the phases of a resource invocation.
+
+Tracing is enabled through `source.trace` or the `PYPI_RESOURCE_TRACE` environment
+variable: `true` writes to stderr, a string appends to that file. Every finished span
+is written as one JSON line:
+
+    {"trace": "...", "span": 3, "parent": 1, "name": "index.fetch", "start": 1700000000.123,
+     "duration_ms": 41.7, "status": "ok", "url": "..."}
+
+`parent` links nested spans, `status` is `error` (with `error` set) if the phase raised.
+"""
+
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict
+
+ENV_VAR = 'PYPI_RESOURCE_TRACE'
+
+_sink = None
+_sink_lock = threading.Lock()
+_trace_id = None
+_span_ids = itertools.count(1)
+_local = threading.local()
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _open_sink(setting):
+    if setting is True or str(setting).lower() in ('1', 'true', 'yes', 'stderr'):
+        return sys.stderr
+    return open(setting, 'a', buffering=1)
+
+
+def configure(resconfig=None):
+    """ Enable tracing if `source.trace` or the environment variable asks for it. """
+    global _sink, _trace_id
+    setting = (resconfig or {}).get('source', {}).get('trace', None)
+    if setting in (None, False, ''):
+        setting = os.getenv(ENV_VAR, None)
+    if setting in (None, False, '') or str(setting).lower() in ('0', 'false', 'no'):
+        return
+    if _sink is None:
+        _sink = _open_sink(setting)
+        _trace_id = uuid.uuid4().hex
+
+
+def enabled() -> bool:
+    return _sink is not None
+
+
+def _emit(record: Dict):
+    line = json.dumps(record, default=str)
+    with _sink_lock:
+        _sink.write(line + '\n')
+        _sink.flush()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time the enclosed block. The yielded dict takes further attributes known only
+    while the phase runs, e.g. the number of bytes transferred.
+    """
+    if _sink is None:
+        yield attributes
+        return
+
+    stack = _stack()
+    span_id = next(_span_ids)
+    record = {'trace': _trace_id, 'span': span_id, 'parent': stack[-1] if stack else None, 'name': name}
+    stack.append(span_id)
+    start = time.time()
+    counter = time.perf_counter()
+    status = 'ok'
+    try:
+        yield attributes
+    except BaseException as e:
+        status = 'error'
+        attributes['error'] = '{}: {}'.format(type(e).__name__, e)
+        raise
+    finally:
+        stack.pop()
+        record.update(start=round(start, 6), duration_ms=round((time.perf_counter() - counter) * 1000, 3),
+                      status=status)
+        record.update(attributes)
+        _emit(record)
+
+
+def propagate(function):
+    """ Wrap `function` so that spans it opens in another thread nest under the current span. """
+    parents = list(_stack())
+
+    def wrapper(*args, **kwargs):
+        _local.stack = list(parents)
+        return function(*args, **kwargs)
+
+    return wrapper
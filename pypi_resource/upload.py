@@ -0,0 +1,255 @@
+# Copyright (c) 2016-Present Pivotal Software, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import mmap
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+import requests
+
+from . import common
+from .hashing import HashingPipeline
+
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = 300
+# seconds between progress messages of an upload
+PROGRESS_INTERVAL = 10
+MIB = 1024 * 1024
+
+# pkginfo attribute -> form field of the legacy upload API, as sent by twine
+METADATA_FIELDS = [
+    ('metadata_version', 'metadata_version'),
+    ('summary', 'summary'),
+    ('home_page', 'home_page'),
+    ('author', 'author'),
+    ('author_email', 'author_email'),
+    ('maintainer', 'maintainer'),
+    ('maintainer_email', 'maintainer_email'),
+    ('license', 'license'),
+    ('description', 'description'),
+    ('description_content_type', 'description_content_type'),
+    ('keywords', 'keywords'),
+    ('platforms', 'platform'),
+    ('classifiers', 'classifiers'),
+    ('download_url', 'download_url'),
+    ('supported_platforms', 'supported_platform'),
+    ('requires_python', 'requires_python'),
+    ('requires_dist', 'requires_dist'),
+    ('provides_dist', 'provides_dist'),
+    ('obsoletes_dist', 'obsoletes_dist'),
+    ('requires_external', 'requires_external'),
+    ('project_urls', 'project_urls'),
+    ('provides_extras', 'provides_extra'),
+]
+
+
+class UploadError(Exception):
+    pass
+
+
+def file_digest(path: str, hash_name: str = 'sha256') -> str:
+    """ Digest of a file, hashed from a memory mapping instead of copying it chunk by chunk. """
+    hasher = hashlib.new(hash_name)
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                hasher.update(data)
+    return hasher.hexdigest()
+
+
+def _filetype(filename: str) -> Tuple[str, str]:
+    """ `filetype` and `pyversion` form fields for a distribution file. """
+    if filename.endswith('.whl'):
+        return 'bdist_wheel', filename[:-len('.whl')].split('-')[-3]
+    elif filename.endswith('.egg'):
+        return 'bdist_egg', filename[:-len('.egg')].split('-')[-1]
+    return 'sdist', 'source'
+
+
+def upload_hashers() -> Dict[str, object]:
+    """ Hashers of all digests the upload API accepts, by their form field. """
+    return {
+        'md5_digest': hashlib.md5(),
+        'sha256_digest': hashlib.sha256(),
+        'blake2_256_digest': hashlib.blake2b(digest_size=32),
+    }
+
+
+def form_fields(pkgpath: str, pkgmeta) -> List[Tuple[str, str]]:
+    """
+    Form fields describing the distribution, taken from the already parsed package metadata.
+    The digests are added by `MultipartBody` while it streams the file.
+    """
+    filetype, pyversion = _filetype(os.path.basename(pkgpath))
+    fields = [
+        (':action', 'file_upload'),
+        ('protocol_version', '1'),
+        ('name', pkgmeta.name),
+        ('version', pkgmeta.version),
+        ('filetype', filetype),
+        ('pyversion', pyversion),
+    ]
+    for attribute, field in METADATA_FIELDS:
+        value = getattr(pkgmeta, attribute, None)
+        if isinstance(value, (list, tuple)):
+            fields.extend((field, str(item)) for item in value)
+        elif value:
+            fields.append((field, str(value)))
+    return fields
+
+
+class MultipartBody:
+    """
+    `multipart/form-data` request body that streams the distribution from disk.
+
+    The length is known upfront so the upload is sent with a Content-Length header
+    instead of chunked transfer encoding, which some indexes reject. At most one chunk
+    of the file is held in memory. While `progress()` is active, the progress is reported
+    every `progress_interval` seconds, also when nothing is read because the upload stalls.
+
+    The digests of `hashers` are computed on background threads while the file is sent and
+    follow it as form fields; hex digests have a fixed length, so the length is still known.
+    """
+
+    def __init__(self, fields: List[Tuple[str, str]], pkgpath: str, chunk_size: int = CHUNK_SIZE,
+                 progress_interval: float = PROGRESS_INTERVAL, hashers: Dict[str, object] = None):
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            raise ValueError('upload chunk size must be a positive number of bytes, got {!r}'.format(chunk_size))
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(self.boundary)
+        self.chunk_size = chunk_size
+        self.filename = os.path.basename(pkgpath)
+        self.progress_interval = progress_interval
+        self.bytes_read = 0
+        self.started = None
+
+        self.pkgpath = pkgpath
+        self.hashers = hashers or {}
+        self.digests = None
+
+        self._head = b''.join(self._part_header(name) + value.encode('utf-8') + b'\r\n' for name, value in fields)
+        self._head += self._part_header('content', os.path.basename(pkgpath))
+        self._tail = '--{}--\r\n'.format(self.boundary).encode('ascii')
+        digests_length = sum(len(self._part_header(name)) + 2 * hasher.digest_size + 2
+                             for name, hasher in self.hashers.items())
+        self._length = len(self._head) + os.path.getsize(pkgpath) + 2 + digests_length + len(self._tail)
+        self._iterator = self._iterate()
+        self._current = b''
+        self._offset = 0
+
+    def _part_header(self, name: str, filename: str = None) -> bytes:
+        disposition = 'form-data; name="{}"'.format(name)
+        if filename:
+            disposition += '; filename="{}"'.format(filename)
+            content_type = 'Content-Type: application/octet-stream\r\n'
+        else:
+            content_type = ''
+        return '--{}\r\nContent-Disposition: {}\r\n{}\r\n'.format(
+            self.boundary, disposition, content_type).encode('utf-8')
+
+    def _iterate(self):
+        yield self._head
+        with open(self.pkgpath, 'rb') as file, HashingPipeline(self.hashers) as pipeline:
+            for chunk in iter(lambda: file.read(self.chunk_size), b''):
+                pipeline.update(chunk)
+                yield chunk
+        self.digests = pipeline.hexdigests()
+        yield b'\r\n' + b''.join(self._part_header(name) + digest.encode('ascii') + b'\r\n'
+                                 for name, digest in self.digests.items())
+        yield self._tail
+
+    def __len__(self):
+        return self._length
+
+    def throughput(self) -> float:
+        """ Bytes per second read so far. """
+        elapsed = time.monotonic() - self.started if self.started is not None else 0
+        return self.bytes_read / elapsed if elapsed > 0 else 0.0
+
+    @contextmanager
+    def progress(self):
+        """ Report the bytes read and the current rate from a timer thread. """
+        stop = threading.Event()
+
+        def report():
+            last = self.bytes_read
+            while not stop.wait(self.progress_interval):
+                read = self.bytes_read
+                common.msg('Uploading {}: {:.1f} of {:.1f} MiB ({:.0%}) at {:.1f} MiB/s', self.filename,
+                           read / MIB, self._length / MIB, read / self._length,
+                           (read - last) / self.progress_interval / MIB)
+                last = read
+
+        thread = threading.Thread(target=report, name='upload-progress', daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None:
+            size = -1
+        parts = []
+        while size != 0:
+            if self._offset >= len(self._current):
+                self._current, self._offset = next(self._iterator, b''), 0
+                if not self._current:
+                    break
+            end = len(self._current) if size < 0 else self._offset + size
+            part = self._current[self._offset:end]
+            self._offset += len(part)
+            if size > 0:
+                size -= len(part)
+            parts.append(part)
+        data = b''.join(parts)
+        if self.started is None:
+            self.started = time.monotonic()
+        self.bytes_read += len(data)
+        return data
+
+
+def upload(pkgpath: str, pkgmeta, url: str, username: str, password: str, session: requests.Session = None,
+           chunk_size: int = CHUNK_SIZE):
+    """
+    Upload a distribution through the legacy upload API (as twine does), within this process,
+    reading it from disk `chunk_size` bytes at a time.
+    """
+    if session is None:
+        with requests.Session() as session:
+            return upload(pkgpath, pkgmeta, url, username, password, session, chunk_size)
+
+    body = MultipartBody(form_fields(pkgpath, pkgmeta), pkgpath, chunk_size, hashers=upload_hashers())
+    with body.progress():
+        response = session.post(
+            url,
+            data=body,
+            auth=(username, password),
+            headers={'Content-Type': body.content_type},
+            allow_redirects=False,
+            timeout=TIMEOUT,
+        )
+    if response.is_redirect:
+        raise UploadError('{} redirected to {}, check the repository_url'.format(url, response.headers.get('Location')))
+    if not response.ok:
+        raise UploadError('Upload of {} failed with {} {}: {}'.format(
+            os.path.basename(pkgpath), response.status_code, response.reason, response.text[:500]))
+    common.msg('Uploaded {} ({} bytes at {:.1f} MiB/s) to {}', os.path.basename(pkgpath), os.path.getsize(pkgpath),
+               body.throughput() / MIB, url)
@@ -0,0 +1,46 @@
+# Copyright (c) 2016-Present Pivotal Software, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Interned PEP 440 versions.
+
+Every distinct version string is parsed once per process and maps to one shared
+`Version` object, whatever number of files, resources or conversions refer to it.
+Sorting compares these objects directly, their comparison key is computed once on parsing.
+"""
+
+from functools import lru_cache
+from typing import Iterable, List
+
+from packaging.version import InvalidVersion, Version  # noqa: F401 (re-exported)
+
+
+@lru_cache(maxsize=None)
+def parse_version(version: str) -> Version:
+    """ The interned `Version` for a version string, raises `InvalidVersion`. """
+    return Version(version)
+
+
+def as_version(version) -> Version:
+    if isinstance(version, Version):
+        return version
+    return parse_version(str(version))
+
+
+def sort_versions(versions: Iterable[Version]) -> List[Version]:
+    return sorted(versions)
+
+
+def max_version(versions: Iterable[Version]) -> Version:
+    return max(versions)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016-Present Pivotal Software, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks for check, in and out against a local fake index.
+
+Every operation runs the real entry point in a child process and reports wall time,
+the child's peak RSS and the requests and bytes the index handled. Sizes can be
+scaled through environment variables, results are appended as JSON lines to
+`$PYPI_RESOURCE_BENCH_OUTPUT` if set.
+
+    python -m pytest -s test/benchmark.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from test.fake_index import FakeIndex, FakeProject
+
+THISDIR = os.path.dirname(os.path.realpath(__file__))
+REPODIR = os.path.join(THISDIR, '..')
+
+VERSIONS = int(os.getenv('PYPI_RESOURCE_BENCH_VERSIONS', '10000'))
+FILES_PER_VERSION = int(os.getenv('PYPI_RESOURCE_BENCH_FILES_PER_VERSION', '300'))
+FILE_SIZE = int(os.getenv('PYPI_RESOURCE_BENCH_FILE_SIZE', str(50 * 1024 * 1024)))
+PACKAGES = int(os.getenv('PYPI_RESOURCE_BENCH_PACKAGES', '200'))
+OUTPUT = os.getenv('PYPI_RESOURCE_BENCH_OUTPUT', None)
+
+
+# Runs the entry point as `python -m` would and records the peak RSS of the process.
+# VmHWM is used rather than the rusage of the child, which on Linux also covers the
+# memory of the benchmark process it was forked from.
+RUNNER = """
+import atexit, runpy, sys
+
+def record_peak_rss(path=sys.argv.pop(1)):
+    with open('/proc/self/status') as status, open(path, 'w') as output:
+        output.write(next(line.split()[1] for line in status if line.startswith('VmHWM:')))
+
+atexit.register(record_peak_rss)
+sys.argv.pop(0)
+runpy.run_module(sys.argv[0], run_name='__main__', alter_sys=True)
+"""
+
+
+def run_entry_point(module, args, resconfig):
+    """ Run `python -m <module>` and return its output, wall time in seconds and peak RSS in KiB. """
+    with tempfile.TemporaryFile(mode='w+') as stderr, tempfile.NamedTemporaryFile(mode='r') as peak_rss:
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-c', RUNNER, peak_rss.name, module] + args, cwd=REPODIR,
+                              input=json.dumps(resconfig), stdout=subprocess.PIPE, stderr=stderr, text=True)
+        elapsed = time.perf_counter() - start
+        if proc.returncode:
+            stderr.seek(0)
+            raise AssertionError('{} exited with {}:\n{}'.format(module, proc.returncode, stderr.read()[-2000:]))
+        maxrss = int(peak_rss.read() or 0)
+    return json.loads(proc.stdout), elapsed, maxrss
+
+
+def report(name, index, elapsed, maxrss):
+    result = dict(benchmark=name, seconds=round(elapsed, 3), maxrss_kib=maxrss, **index.stats)
+    print('{benchmark:<40} {seconds:>8.3f}s {maxrss_kib:>10} KiB {requests:>6} requests '
+          '{sent:>12} bytes sent {received:>12} bytes received'.format(**result), file=sys.stderr)
+    if OUTPUT:
+        with open(OUTPUT, 'a') as file:
+            file.write(json.dumps(result) + '\n')
+
+
+def make_resconfig(index, name, **kwargs):
+    resconfig = {
+        'source': {
+            'name': name,
+            'repository': {
+                'index_url': index.url + '/simple',
+                'repository_url': index.url + '/legacy/',
+                'username': 'bench',
+                'password': 'bench',
+            },
+        },
+    }
+    resconfig['source'].update(kwargs)
+    return resconfig
+
+
+class Benchmark(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.many_versions = FakeProject('bench-versions', VERSIONS, files_per_version=3,
+                                        latest_file_size=FILE_SIZE)
+        cls.many_files = FakeProject('bench-files', 20, files_per_version=FILES_PER_VERSION)
+        cls.many_packages = [FakeProject('bench-package-{}'.format(i), 50) for i in range(PACKAGES)]
+        # build the pages upfront, so that the measurements only cover the resource
+        for project in [cls.many_versions, cls.many_files] + cls.many_packages:
+            project.files
+
+    def measure(self, name, module, args, resconfig, html_only=False):
+        with FakeIndex([self.many_versions, self.many_files] + self.many_packages, html_only=html_only) as index:
+            resconfig = resconfig(index)
+            index.reset()
+            output, elapsed, maxrss = run_entry_point(module, args, resconfig)
+            report(name, index, elapsed, maxrss)
+        return output
+
+    def test_check_many_versions_json(self):
+        output = self.measure('check many versions (json)', 'pypi_resource.check', [],
+                              lambda index: make_resconfig(index, 'bench-versions'))
+        self.assertEqual(output[-1]['version'], self.many_versions.versions[-1])
+
+    def test_check_many_versions_html(self):
+        output = self.measure('check many versions (html)', 'pypi_resource.check', [],
+                              lambda index: make_resconfig(index, 'bench-versions'), html_only=True)
+        self.assertEqual(output[-1]['version'], self.many_versions.versions[-1])
+
+    def test_check_many_files(self):
+        output = self.measure('check many files per version', 'pypi_resource.check', [],
+                              lambda index: make_resconfig(index, 'bench-files', platform='manylinux_2_17_x86_64',
+                                                             packaging='binary'))
+        self.assertEqual(output[-1]['version'], self.many_files.versions[-1])
+
+    def test_check_many_packages(self):
+        output = self.measure('check many packages (batch)', 'pypi_resource.check', ['--batch'],
+                              lambda index: [make_resconfig(index, p.name) for p in self.many_packages])
+        self.assertEqual([len(result['versions']) for result in output], [50] * len(self.many_packages))
+
+    def test_in_latest(self):
+        with tempfile.TemporaryDirectory() as destdir:
+            output = self.measure('in latest version', 'pypi_resource.in_', [destdir],
+                                  lambda index: make_resconfig(index, 'bench-versions', packaging='source'))
+        self.assertEqual(output['version']['version'], self.many_versions.versions[-1])
+
+    def test_in_metadata_only(self):
+        def resconfig(index):
+            config = make_resconfig(index, 'bench-versions', platform='manylinux_2_5_x86_64',
+                                    python_version='3.8', packaging='binary')
+            config['params'] = {'metadata_only': True}
+            return config
+
+        with tempfile.TemporaryDirectory() as destdir:
+            output = self.measure('in latest version (metadata only)', 'pypi_resource.in_', [destdir], resconfig)
+        self.assertEqual(output['version']['version'], self.many_versions.versions[-1])
+
+    def test_out(self):
+        version = self.many_versions.versions[-1]
+        filename = next(f for f in self.many_versions.filenames(version) if f.endswith('.whl'))
+        with tempfile.TemporaryDirectory() as srcdir:
+            with open(os.path.join(srcdir, filename), 'wb') as file:
+                file.write(self.many_versions.content(filename))
+
+            def resconfig(index):
+                config = make_resconfig(index, 'bench-versions')
+                config['params'] = {'glob': '*.whl'}
+                return config
+
+            output = self.measure('out', 'pypi_resource.out', [srcdir], resconfig)
+        self.assertEqual(output['version']['version'], version)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+# Copyright (c) 2016-Present Pivotal Software, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local stand-in for a package index, serving synthetic projects.
+
+Speaks the PEP 503 HTML and PEP 691 JSON simple API (with ETags), the legacy
+`/pypi/<name>/json` API, PEP 658 metadata files, file downloads with range requests
+and the legacy upload API, and counts the requests and bytes it handled.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import random
+import re
+import tarfile
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+SIMPLE_JSON = 'application/vnd.pypi.simple.v1+json'
+
+
+class FakeProject:
+    """
+    A project with `versions` releases of `files_per_version` files each: one sdist plus
+    wheels for distinct platforms. Files are `file_size` bytes, except those of the newest
+    release which are `latest_file_size` bytes.
+    """
+
+    def __init__(self, name, versions, files_per_version=3, file_size=1024, latest_file_size=None):
+        self.name = name
+        self.wheel_name = re.sub(r'[-_.]+', '_', name)
+        self.versions = ['1.{}.{}'.format(i // 100, i % 100) for i in range(versions)]
+        self.files_per_version = files_per_version
+        self.file_size = file_size
+        self.latest_file_size = latest_file_size or file_size
+        self._files = None
+        self._content = {}
+        self._lock = threading.Lock()
+
+    def filenames(self, version):
+        yield '{}-{}.tar.gz'.format(self.name, version)
+        for k in range(self.files_per_version - 1):
+            python = 'cp3{}'.format(8 + k % 6)
+            yield '{}-{}-{}-{}-manylinux_2_{}_x86_64.whl'.format(self.wheel_name, version, python, python, 5 + k // 6)
+
+    @property
+    def files(self):
+        """ filename -> (version, sha256, metadata sha256), built once. """
+        with self._lock:
+            if self._files is None:
+                files = {}
+                for version in self.versions:
+                    for filename in self.filenames(version):
+                        content = self._build(filename, version)
+                        files[filename] = (version, hashlib.sha256(content).hexdigest(),
+                                           hashlib.sha256(self.metadata(version)).hexdigest())
+                self._files = files
+        return self._files
+
+    def metadata(self, version):
+        return 'Metadata-Version: 2.1\nName: {}\nVersion: {}\nSummary: synthetic benchmark package\n'.format(
+            self.name, version).encode()
+
+    def _build(self, filename, version):
+        size = self.latest_file_size if version == self.versions[-1] else self.file_size
+        padding = random.Random(filename).getrandbits(8 * size).to_bytes(size, 'little')
+        buffer = io.BytesIO()
+        # fixed timestamps, so that every build of a file has the same digest
+        if filename.endswith('.whl'):
+            with zipfile.ZipFile(buffer, 'w') as archive:
+                for name, data in [('{}/data.bin'.format(self.wheel_name), padding),
+                                   ('{}-{}.dist-info/METADATA'.format(self.wheel_name, version), self.metadata(version))]:
+                    archive.writestr(zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0)), data)
+        else:
+            with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=1, mtime=0) as compressed:
+                with tarfile.open(fileobj=compressed, mode='w') as archive:
+                    for name, data in [('PKG-INFO', self.metadata(version)), ('data.bin', padding)]:
+                        info = tarfile.TarInfo('{}-{}/{}'.format(self.name, version, name))
+                        info.size = len(data)
+                        archive.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    def content(self, filename):
+        version = self.files[filename][0]
+        with self._lock:
+            if filename not in self._content:
+                self._content[filename] = self._build(filename, version)
+            return self._content[filename]
+
+    def simple_html(self):
+        lines = ['<!DOCTYPE html>', '<html><body>']
+        for filename, (unused_version, sha256, metadata_sha256) in self.files.items():
+            metadata = ' data-dist-info-metadata="sha256={}"'.format(metadata_sha256) if filename.endswith('.whl') else ''
+            lines.append('<a href="/files/{0}#sha256={1}"{2}>{0}</a><br/>'.format(filename, sha256, metadata))
+        lines.append('</body></html>')
+        return '\n'.join(lines).encode()
+
+    def simple_json(self):
+        files = []
+        for filename, (unused_version, sha256, metadata_sha256) in self.files.items():
+            item = {'filename': filename, 'url': '/files/' + filename, 'hashes': {'sha256': sha256}}
+            if filename.endswith('.whl'):
+                item['dist-info-metadata'] = {'sha256': metadata_sha256}
+            files.append(item)
+        return json.dumps({'meta': {'api-version': '1.0'}, 'name': self.name, 'files': files}).encode()
+
+    def legacy_json(self):
+        releases = {version: [] for version in self.versions}
+        for filename, (version, sha256, unused_metadata_sha256) in self.files.items():
+            releases[version].append({'filename': filename, 'url': '/files/' + filename, 'digests': {'sha256': sha256}})
+        return json.dumps({'info': {'name': self.name}, 'releases': releases}).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None, head=False):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+            self.server.index.count(sent=len(body))
+
+    def _page(self, body, content_type):
+        etag = '"{}"'.format(hashlib.sha256(body).hexdigest()[:16])
+        if self.headers.get('If-None-Match', None) == etag:
+            return self._send(304, headers={'ETag': etag})
+        self._send(200, body, {'Content-Type': content_type, 'ETag': etag})
+
+    def _file(self, project, filename, head=False):
+        content = project.content(filename)
+        headers = {'Accept-Ranges': 'bytes', 'Content-Type': 'application/octet-stream'}
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if match and not head:
+            start, end = match.groups()
+            if start:
+                start, end = int(start), min(int(end) if end else len(content) - 1, len(content) - 1)
+            else:
+                start, end = len(content) - int(end), len(content) - 1
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, len(content))
+            return self._send(206, content[start:end + 1], headers)
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(content)
+            self.server.index.count(sent=len(content))
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        index = self.server.index
+        index.count(requests=1)
+        path = unquote(self.path.split('?')[0])
+        parts = [part for part in path.split('/') if part]
+
+        if len(parts) == 2 and parts[0] == 'simple' and parts[1] in index.projects:
+            project = index.projects[parts[1]]
+            if SIMPLE_JSON in self.headers.get('Accept', '') and not index.html_only:
+                return self._page(project.simple_json(), SIMPLE_JSON)
+            return self._page(project.simple_html(), 'text/html')
+        if len(parts) == 3 and parts[0] == 'pypi' and parts[2] == 'json' and parts[1] in index.projects:
+            return self._page(index.projects[parts[1]].legacy_json(), 'application/json')
+        if len(parts) == 2 and parts[0] == 'files':
+            filename = parts[1]
+            for project in index.projects.values():
+                if filename.endswith('.metadata') and filename[:-len('.metadata')] in project.files:
+                    version = project.files[filename[:-len('.metadata')]][0]
+                    return self._send(200, project.metadata(version), head=head)
+                if filename in project.files:
+                    return self._file(project, filename, head)
+        self._send(404, head=head)
+
+    def do_POST(self):
+        index = self.server.index
+        index.count(requests=1)
+        length = int(self.headers.get('Content-Length', 0))
+        remaining = length
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+        index.count(received=length)
+        self._send(200 if self.path.rstrip('/') == '/legacy' else 404)
+
+
+class FakeIndex:
+    """ Runs the fake index on a local port for the duration of a `with` block. """
+
+    def __init__(self, projects, html_only=False):
+        self.projects = {project.name: project for project in projects}
+        self.html_only = html_only
+        self.stats = {}
+        self._lock = threading.Lock()
+        self.reset()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.index = self
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def reset(self):
+        with self._lock:
+            self.stats = {'requests': 0, 'sent': 0, 'received': 0}
+
+    def count(self, **kwargs):
+        with self._lock:
+            for key, value in kwargs.items():
+                self.stats[key] += value
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
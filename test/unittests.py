@@ -12,20 +12,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import io
 import json
 import os
+import email.parser
+import hashlib
+import subprocess
 import sys
+import tarfile
+import tempfile
+import time
 import unittest
-from unittest.mock import patch
+import zipfile
+from unittest.mock import ANY, MagicMock, patch
 
-from pip._internal.models.candidate import InstallationCandidate
-from pip._internal.models.link import Link
+import requests
+from packaging import tags
 
-from pypi_resource import check, common, pipio
+from pypi_resource import cache, check, common, filters, hashing, in_, index, metadata, out, pipio, retry, trace, upload, versioning
 
 here = os.path.dirname(os.path.realpath(__file__))
+# cold-start budget per entry point, generous enough for slow CI workers
+import_budget_ms = float(os.getenv('PYPI_RESOURCE_IMPORT_BUDGET_MS', '500'))
 canned_versions = ["0.9.3rc1", "0.9.1", "0.9.2"]
+canned_html = """<!DOCTYPE html>
+<html><body>
+<a href="https://files.example.org/tile_generator-0.9.1-py3-none-any.whl#sha256=aaa">tile_generator-0.9.1-py3-none-any.whl</a>
+<a href="../../packages/tile-generator-0.9.2.tar.gz#sha256=bbb">tile-generator-0.9.2.tar.gz</a>
+<a href="../../packages/tile-generator-0.9.3rc1.tar.gz" data-requires-python="&gt;=3.6">tile-generator-0.9.3rc1.tar.gz</a>
+<a href="../../packages/tile-generator-0.9.0.zip" data-yanked="">tile-generator-0.9.0.zip</a>
+</body></html>
+"""
 
 
 def make_stream(json_obj):
@@ -119,9 +137,9 @@ class TestCheck(unittest.TestCase):
     def setUp(self):
         candidates = []
         for version in canned_versions:
-            url = "https://foo:12345/repository/unittest-{}.tgz#md5=4711".format(version)
-            url = Link(url)
-            candidate = InstallationCandidate('unittest', version, url)
+            filename = "unittest-{}.tgz".format(version)
+            url = "https://foo:12345/repository/" + filename
+            candidate = index.Candidate('unittest', pipio.Version(version), filename, url, {'md5': '4711'})
             candidates.append(candidate)
         self.canned_candidates = candidates
 
@@ -131,7 +149,7 @@ class TestCheck(unittest.TestCase):
         self.assertEqual(check.truncate_smaller_versions([1, 2, 3], 3), [3])
         self.assertEqual(check.truncate_smaller_versions([1, 2, 3], 4), [3])
 
-    @patch('pypi_resource.pipio._pip_query_candidates')
+    @patch('pypi_resource.pipio._query_candidates')
     def test_newest_version(self, mock_info):
         mock_info.return_value = self.canned_candidates
         version = {'version': '0.9.2'}
@@ -139,7 +157,7 @@ class TestCheck(unittest.TestCase):
         result = check.check(instream)
         self.assertEqual(result, [version])
 
-    @patch('pypi_resource.pipio._pip_query_candidates')
+    @patch('pypi_resource.pipio._query_candidates')
     def test_has_newer_version(self, mock_info):
         mock_info.return_value = self.canned_candidates
         version = {'version': '0.9.1'}
@@ -147,7 +165,7 @@ class TestCheck(unittest.TestCase):
         result = check.check(instream)
         self.assertEqual(result, [{'version': '0.9.1'}, {'version': '0.9.2'}])
 
-    @patch('pypi_resource.pipio._pip_query_candidates')
+    @patch('pypi_resource.pipio._query_candidates')
     def test_has_newer_prerelease(self, mock_info):
         mock_info.return_value = self.canned_candidates
         version = {'version': '0.9.2'}
@@ -155,6 +173,948 @@ class TestCheck(unittest.TestCase):
         result = check.check(instream)
         self.assertEqual(result, [{'version': '0.9.2'}, {'version': '0.9.3rc1'}])
 
+    @patch('pypi_resource.pipio._query_candidates')
+    def test_current_version_gone(self, mock_info):
+        mock_info.return_value = self.canned_candidates
+        result = check.check(make_input_stream({'version': '0.9.9'}))
+        self.assertEqual(result, [{'version': '0.9.2'}])
+
+    @patch('pypi_resource.pipio._query_candidates')
+    def test_version_artefact(self, mock_info):
+        mock_info.return_value = self.canned_candidates
+        result = check.check(make_input_stream({'version': '0.9.2'}, version_artefact=True))
+        self.assertEqual(result, [{'version': '0.9.2', 'filename': 'unittest-0.9.2.tgz', 'hash': 'md5:4711',
+                                   'url': 'https://foo:12345/repository/unittest-0.9.2.tgz'}])
+
+    @patch('pypi_resource.pipio._build_session')
+    @patch('pypi_resource.pipio._query_candidates')
+    def test_check_many(self, mock_info, mock_session):
+        def query(resconfig, session, candidate_filter):
+            if resconfig['source']['name'] == 'missing':
+                raise requests.HTTPError('403 Forbidden')
+            return self.canned_candidates
+
+        mock_info.side_effect = query
+        resconfigs = [make_input({'version': '0.9.2'}), make_input(None, pre_release=True), make_input(None),
+                      make_input(None, unknown_key=True), make_input(None, packaging='wheel')]
+        resconfigs[2]['source']['name'] = 'missing'
+        with patch('sys.stderr', io.StringIO()):
+            result = check.check_many(resconfigs, workers=2)
+
+        self.assertEqual(result[0], {'name': 'tile-generator', 'versions': [{'version': '0.9.2'}]})
+        self.assertEqual(result[1]['versions'][-1], {'version': '0.9.3rc1'})
+        self.assertEqual(result[2], {'name': 'missing', 'error': 'HTTPError: 403 Forbidden'})
+        # invalid configurations fail on their own
+        self.assertEqual(result[3]['name'], 'tile-generator')
+        self.assertTrue(result[3]['error'].startswith('KeyError'))
+        self.assertTrue(result[4]['error'].startswith('AssertionError'))
+        self.assertEqual(len(result), 5)
+        # all resources use the same repository, and so one session
+        mock_session.assert_called_once()
+
+    @patch('pypi_resource.pipio._build_session')
+    @patch('pypi_resource.pipio._query_candidates')
+    def test_check_many_session_failure(self, mock_info, mock_session):
+        session = MagicMock()
+
+        def build_session(resconfig, pool_size=None):
+            if 'broken' in resconfig['source']['repository']['index_url']:
+                raise ValueError('no session')
+            return session
+
+        mock_info.return_value = self.canned_candidates
+        mock_session.side_effect = build_session
+        resconfigs = [make_input(None), make_input(None)]
+        resconfigs[1]['source']['repository'] = {'index_url': 'https://broken.local/simple'}
+        with patch('sys.stderr', io.StringIO()):
+            result = check.check_many(resconfigs)
+
+        self.assertEqual(result[0]['versions'][-1], {'version': '0.9.2'})
+        self.assertEqual(result[1], {'name': 'tile-generator', 'error': 'ValueError: no session'})
+        session.__exit__.assert_called_once()
+
+
+class TestTrace(unittest.TestCase):
+    @patch('pypi_resource.pipio._query_candidates')
+    def test_check_spans(self, mock_info):
+        mock_info.return_value = [index.Candidate('unittest', pipio.Version(version), 'unittest-{}.tgz'.format(version),
+                                                  'https://foo/unittest-{}.tgz'.format(version), {})
+                                  for version in canned_versions]
+        sink = io.StringIO()
+        with patch.object(trace, '_sink', sink):
+            check.check(make_input_stream({'version': '0.9.2'}))
+        spans = {span['name']: span for span in map(json.loads, sink.getvalue().splitlines())}
+
+        self.assertEqual(set(spans), {'check', 'merge_defaults', 'list_candidates', 'filter_candidates'})
+        self.assertIsNone(spans['check']['parent'])
+        self.assertEqual(spans['filter_candidates']['parent'], spans['check']['span'])
+        self.assertEqual(spans['list_candidates']['candidates'], len(canned_versions))
+        self.assertTrue(all(span['status'] == 'ok' and span['duration_ms'] >= 0 for span in spans.values()))
+
+    def test_error_and_retry_attempts(self):
+        sink = io.StringIO()
+        failing = MagicMock(side_effect=[requests.ConnectionError('boom'), 'done'], __name__='failing')
+        with patch.object(trace, '_sink', sink), patch('sys.stderr', io.StringIO()):
+            self.assertEqual(retry.retry_wrapper(2, 0)(failing)(), 'done')
+        spans = [json.loads(line) for line in sink.getvalue().splitlines()]
+
+        self.assertEqual([(s['attempt'], s['status']) for s in spans], [(1, 'error'), (2, 'ok')])
+        self.assertEqual(spans[0]['error'], 'ConnectionError: boom')
+
+    def test_disabled_by_default(self):
+        with patch.dict(os.environ, {trace.ENV_VAR: ''}):
+            trace.configure({'source': {}})
+        self.assertFalse(trace.enabled())
+
+
+class TestIndexCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_put_get(self):
+        index_cache = cache.IndexCache(self.tmpdir.name)
+        self.assertIsNone(index_cache.get('https://foo/simple/unittest/'))
+        index_cache.put('https://foo/simple/unittest/', {'etag': '"1"', 'files': []})
+        entry = index_cache.get('https://foo/simple/unittest/')
+        self.assertEqual(entry['etag'], '"1"')
+        self.assertEqual(cache.IndexCache.conditional_headers(entry), {'If-None-Match': '"1"'})
+
+    def test_lock_files_bounded(self):
+        artefact_cache = cache.ArtefactCache(self.tmpdir.name)
+        for i in range(200):
+            with artefact_cache.lock('sha256', '{:064x}'.format(i)):
+                pass
+        with open(os.path.join(self.tmpdir.name, 'sha256-0.lock'), 'w'):
+            pass
+        artefact_cache.evict()
+        lock_files = [name for name in os.listdir(self.tmpdir.name) if name.endswith('.lock')]
+        self.assertLessEqual(len(lock_files), cache.LOCK_STRIPES)
+        self.assertNotIn('sha256-0.lock', lock_files)
+
+    def test_lru_eviction(self):
+        index_cache = cache.IndexCache(self.tmpdir.name)
+        for i, url in enumerate(['a', 'b', 'c']):
+            index_cache.put(url, {'body': 'x' * 100})
+            os.utime(index_cache._path(url), (time.time() - 100 + i, time.time() - 100 + i))
+        # touching 'a' makes 'b' the least recently used entry
+        index_cache.get('a')
+        index_cache.max_size = 250
+        index_cache.evict()
+        self.assertIsNotNone(index_cache.get('a'))
+        self.assertIsNone(index_cache.get('b'))
+
+    @patch('pypi_resource.pipio._build_session')
+    def test_not_modified_reuses_files(self, mock_session):
+        session = mock_session.return_value.__enter__.return_value
+        session.get.return_value = MagicMock(
+            status_code=200, text=canned_html, url='https://pypi.org/simple/tile-generator/',
+            headers={'ETag': '"abc"', 'Content-Type': 'text/html'})
+        resconfig = common.merge_defaults(make_input(None, index_cache_dir=self.tmpdir.name))
+
+        first = pipio.pip_get_versions(resconfig)
+        self.assertNotIn('If-None-Match', session.get.call_args[1]['headers'])
+
+        session.get.return_value = MagicMock(status_code=304, headers={})
+        second = pipio.pip_get_versions(resconfig)
+        self.assertEqual(session.get.call_args[1]['headers']['If-None-Match'], '"abc"')
+        self.assertEqual(first, second)
+        self.assertEqual(sorted(str(v) for v in second), ['0.9.0', '0.9.1', '0.9.2'])
+
+    @patch('pypi_resource.pipio._build_session')
+    def test_shared_between_selections(self, mock_session):
+        session = mock_session.return_value.__enter__.return_value
+        session.get.return_value = MagicMock(
+            status_code=200, text=canned_html, url='https://pypi.org/simple/tile-generator/',
+            headers={'Content-Type': 'text/html'})
+        wheels = common.merge_defaults(make_input(None, index_cache_dir=self.tmpdir.name, index_cache_ttl=60,
+                                                  filename_match='.whl'))
+        pre_releases = common.merge_defaults(make_input(None, index_cache_dir=self.tmpdir.name, index_cache_ttl=60,
+                                                        pre_release=True, release=False))
+
+        self.assertEqual([str(v) for v in pipio.pip_get_versions(wheels)], ['0.9.1'])
+        self.assertEqual([str(v) for v in pipio.pip_get_versions(pre_releases)], ['0.9.3rc1'])
+        self.assertEqual(session.get.call_count, 1)
+
+
+class TestArtefactCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cachedir = os.path.join(self.tmpdir.name, 'cache')
+        self.destdir = os.path.join(self.tmpdir.name, 'dest')
+        os.makedirs(self.destdir)
+        self.content = make_wheel()
+        self.digest = hashlib.sha256(self.content).hexdigest()
+
+    def test_put_get(self):
+        source = os.path.join(self.tmpdir.name, 'source.whl')
+        with open(source, 'wb') as file:
+            file.write(self.content)
+        artefact_cache = cache.ArtefactCache(self.cachedir)
+        target = os.path.join(self.destdir, 'unittest.whl')
+        self.assertIsNone(artefact_cache.get('sha256', self.digest, target))
+        self.assertFalse(os.path.exists(target))
+
+        artefact_cache.put('sha256', self.digest, source)
+        self.assertIn(artefact_cache.get('sha256', self.digest, target),
+                      ['reflink', 'hardlink', 'copy_file_range', 'copy'])
+        with open(target, 'rb') as file:
+            self.assertEqual(file.read(), self.content)
+
+    def test_download_once(self):
+        session = MagicMock()
+        response = session.get.return_value.__enter__.return_value
+        response.iter_content.return_value = [self.content]
+        resconfig = common.merge_defaults(make_input(None, artefact_cache_dir=self.cachedir))
+        url = 'https://foo/unittest-0.9.2-py3-none-any.whl'
+        with patch('sys.stderr', io.StringIO()):
+            for destdir in ['first', 'second']:
+                destdir = os.path.join(self.destdir, destdir)
+                os.makedirs(destdir)
+                path = pipio.pip_download_link(resconfig, url, destdir, 'sha256:' + self.digest, session)
+                with open(path, 'rb') as file:
+                    self.assertEqual(file.read(), self.content)
+        # the second resource got the artefact from the cache
+        session.get.assert_called_once()
+
+
+class TestIndex(unittest.TestCase):
+    page_url = 'https://pypi.org/simple/tile-generator/'
+
+    def test_parse_html(self):
+        files = index.parse_html(canned_html, self.page_url)
+        self.assertEqual(len(files), 4)
+        self.assertEqual(files[0]['url'], 'https://files.example.org/tile_generator-0.9.1-py3-none-any.whl')
+        self.assertEqual(files[0]['hashes'], {'sha256': 'aaa'})
+        self.assertEqual(files[1]['url'], 'https://pypi.org/packages/tile-generator-0.9.2.tar.gz')
+        self.assertEqual(files[2]['requires_python'], '>=3.6')
+        self.assertTrue(files[3]['yanked'])
+
+    def test_parse_json(self):
+        data = {
+            'meta': {'api-version': '1.0'},
+            'name': 'tile-generator',
+            'files': [{'filename': 'tile-generator-0.9.2.tar.gz', 'url': '../../packages/tile-generator-0.9.2.tar.gz',
+                       'hashes': {'sha256': 'bbb'}, 'requires-python': '>=3.6', 'yanked': 'broken'}],
+        }
+        files = index.parse_response(json.dumps(data), index.SIMPLE_JSON, self.page_url)
+        self.assertEqual(files, [{
+            'filename': 'tile-generator-0.9.2.tar.gz',
+            'url': 'https://pypi.org/packages/tile-generator-0.9.2.tar.gz',
+            'hashes': {'sha256': 'bbb'},
+            'requires_python': '>=3.6',
+            'yanked': True,
+            'metadata': None,
+        }])
+
+    def test_filenames(self):
+        name, version, tags = index.parse_wheel_filename('tile_generator-1.0-1-cp39-cp39-manylinux2014_x86_64.whl')
+        self.assertEqual((name, version), ('tile_generator', '1.0'))
+        self.assertEqual(len(tags), 1)
+        self.assertEqual(index.parse_sdist_filename('tile-generator-1.0.post1.tar.gz', 'tile_generator'),
+                         ('tile-generator', '1.0.post1'))
+        with self.assertRaises(ValueError):
+            index.parse_sdist_filename('other-1.0.tar.gz', 'tile_generator')
+        self.assertIsNone(index.to_candidate('tile-generator', {'filename': 'tile_generator-1.0-py2.7.egg'}))
+
+    def test_compatibility(self):
+        resconfig = common.merge_defaults(make_input(None, python_version='3.9', platform='manylinux2014_x86_64'))
+        self.assertEqual(filters.target_python(resconfig), '3.9.0')
+
+        def compatible(filename, requires_python=None):
+            record = {'filename': filename, 'url': filename, 'hashes': {}, 'requires_python': requires_python, 'yanked': False}
+            return filters.CandidateFilter(resconfig).accepts(index.to_candidate('foo', record))
+
+        self.assertTrue(compatible('foo-1.0-cp39-cp39-manylinux2014_x86_64.whl'))
+        self.assertTrue(compatible('foo-1.0-cp39-cp39-manylinux1_x86_64.whl'))
+        self.assertTrue(compatible('foo-1.0-py3-none-any.whl'))
+        self.assertFalse(compatible('foo-1.0-cp38-cp38-manylinux2014_x86_64.whl'))
+        self.assertFalse(compatible('foo-1.0-cp39-cp39-win_amd64.whl'))
+        self.assertTrue(compatible('foo-1.0.tar.gz', '>=3.6'))
+        self.assertFalse(compatible('foo-1.0.tar.gz', '<3'))
+
+        resconfig['source']['packaging'] = 'binary'
+        self.assertFalse(compatible('foo-1.0.tar.gz'))
+
+    def test_platform_expansion(self):
+        def compatible(platform, wheel_platform):
+            supported = index.supported_tags(platform, '3.10')
+            return not supported.isdisjoint(index.parse_wheel_filename(
+                'foo-1.0-cp310-cp310-{}.whl'.format(wheel_platform))[2])
+
+        self.assertTrue(compatible('manylinux_2_17_x86_64', 'manylinux_2_5_x86_64'))
+        self.assertTrue(compatible('manylinux_2_17_x86_64', 'manylinux2010_x86_64'))
+        self.assertTrue(compatible('manylinux_2_17_x86_64', 'manylinux1_x86_64'))
+        self.assertTrue(compatible('manylinux_2_28_x86_64', 'manylinux2014_x86_64'))
+        self.assertTrue(compatible('manylinux_2_28_aarch64', 'manylinux_2_17_aarch64'))
+        self.assertTrue(compatible('manylinux2014_x86_64', 'manylinux_2_5_x86_64'))
+        self.assertTrue(compatible('manylinux2014_x86_64', 'manylinux_2_17_x86_64'))
+        self.assertTrue(compatible('musllinux_1_2_x86_64', 'musllinux_1_1_x86_64'))
+        self.assertFalse(compatible('manylinux_2_17_x86_64', 'manylinux_2_28_x86_64'))
+        self.assertFalse(compatible('manylinux2010_x86_64', 'manylinux2014_x86_64'))
+        self.assertFalse(compatible('musllinux_1_1_x86_64', 'musllinux_1_2_x86_64'))
+        self.assertFalse(compatible('musllinux_1_2_x86_64', 'manylinux_2_5_x86_64'))
+        self.assertFalse(compatible('manylinux_2_17_aarch64', 'manylinux_2_17_x86_64'))
+
+    def test_two_digit_minor_version(self):
+        supported = index.supported_tags('manylinux2014_x86_64', '3.10')
+        self.assertIn(tags.Tag('cp310', 'cp310', 'manylinux2014_x86_64'), supported)
+        self.assertIn(tags.Tag('cp39', 'abi3', 'manylinux_2_5_x86_64'), supported)
+        self.assertIn(tags.Tag('py310', 'none', 'any'), supported)
+        self.assertNotIn(tags.Tag('cp3_10', 'cp3_10', 'manylinux2014_x86_64'), supported)
+
+    def test_abi_and_implementation(self):
+        def compatible(filename, **kwargs):
+            resconfig = common.merge_defaults(make_input(None, python_version='3.10', platform='manylinux2014_x86_64',
+                                                         **kwargs))
+            record = {'filename': filename, 'url': filename, 'hashes': {}, 'requires_python': None, 'yanked': False}
+            return filters.CandidateFilter(resconfig).accepts(index.to_candidate('foo', record))
+
+        self.assertTrue(compatible('foo-1.0-cp310-cp310-manylinux2014_x86_64.whl', python_implementation='cp'))
+        self.assertFalse(compatible('foo-1.0-pp310-pypy310_pp73-manylinux2014_x86_64.whl', python_implementation='cp'))
+        self.assertTrue(compatible('foo-1.0-pp310-pypy310_pp73-manylinux2014_x86_64.whl',
+                                   python_implementation='pp', python_abi='pypy310_pp73'))
+        self.assertFalse(compatible('foo-1.0-cp310-cp310-manylinux2014_x86_64.whl', python_abi='abi3'))
+        self.assertTrue(compatible('foo-1.0-cp38-abi3-manylinux2014_x86_64.whl', python_abi='abi3'))
+        self.assertTrue(compatible('foo-1.0-cp38-abi3-manylinux2014_x86_64.whl', python_abi='cp310, abi3'))
+        self.assertTrue(compatible('foo-1.0-py3-none-any.whl', python_implementation='pp', python_abi=['none']))
+
+        self.assertIs(index.supported_tags('manylinux2014_x86_64', '3.10', ('abi3',), 'cp'),
+                      index.supported_tags('manylinux2014_x86_64', '3.10', ('abi3',), 'cp'))
+
+    def test_filename_match(self):
+        self.assertTrue(filters.compile_filename_match('py2.py3')('foo-1.0-py2.py3-none-any.whl'))
+        self.assertFalse(filters.compile_filename_match('*.whl')('foo-1.0-py2.py3-none-any.whl'))
+        self.assertTrue(filters.compile_filename_match('glob:*manylinux*.whl')('foo-1.0-cp39-cp39-manylinux1_x86_64.whl'))
+        self.assertFalse(filters.compile_filename_match('glob:*manylinux*.whl')('foo-1.0.tar.gz'))
+        self.assertTrue(filters.compile_filename_match(r're:cp3\d+-')('foo-1.0-cp310-cp310-win_amd64.whl'))
+        self.assertFalse(filters.compile_filename_match(r're:cp3\d+-')('foo-1.0-py3-none-any.whl'))
+
+    def test_pushdown(self):
+        resconfig = common.merge_defaults(make_input(None, version_spec='>=0.9.1,<1', packaging='source'))
+        candidate_filter = filters.CandidateFilter(resconfig, min_version=pipio.Version('0.9.1'))
+        records = [{'filename': 'tile-generator-{}.tar.gz'.format(v), 'url': 'u', 'hashes': {}, 'requires_python': None,
+                    'yanked': False} for v in ['0.8.0', '0.9.0', '0.9.1', '0.9.2', '0.9.3rc1', '1.0.0']]
+        records.append(dict(records[-1], filename='tile_generator-0.9.2-py3-none-any.whl'))
+
+        with patch.object(versioning, 'parse_version', wraps=versioning.parse_version) as mock_version:
+            candidates = [index.to_candidate('tile-generator', record, candidate_filter.parse_version)
+                          for record in records if candidate_filter.accepts_filename(record['filename'])]
+        self.assertEqual([str(c.version) for c in candidates if c], ['0.9.1', '0.9.2'])
+        # the wheel was rejected by its filename, before its version was parsed
+        self.assertEqual(mock_version.call_count, 6)
+
+    def test_pinned_version(self):
+        resconfig = common.merge_defaults(make_input({'version': '0.9.2'}))
+        candidate_filter = filters.CandidateFilter(resconfig, version=resconfig['version']['version'])
+        records = [{'filename': 'tile_generator-{}-py3-none-any.whl'.format(v), 'url': 'u', 'hashes': {},
+                    'requires_python': None, 'yanked': False} for v in ['0.9.1', '0.9.2', '0.9.3']]
+        with patch.object(index.tags, 'parse_tag', wraps=index.tags.parse_tag) as mock_parse_tag:
+            candidates = [index.to_candidate('tile-generator', record, candidate_filter.parse_version)
+                          for record in records]
+        self.assertEqual([str(c.version) for c in candidates if c], ['0.9.2'])
+        # wheel tags of other versions are not parsed
+        self.assertEqual(mock_parse_tag.call_count, 1)
+
+    @patch('pypi_resource.pipio._build_session')
+    def test_pinned_version_json_api(self, mock_session):
+        session = mock_session.return_value.__enter__.return_value
+        session.get.return_value = MagicMock(
+            status_code=200, url='https://pypi.org/pypi/tile-generator/0.9.2/json',
+            text=json.dumps({'urls': [{'filename': 'tile_generator-0.9.2-py3-none-any.whl', 'url': 'https://foo/w',
+                                       'digests': {'sha256': 'abc'}}]}),
+            headers={'Content-Type': 'application/json'})
+        resconfig = common.merge_defaults(make_input({'version': '0.9.2'}, repository={'index_api': 'json'}))
+        package_info, version = in_.list_version(resconfig)
+        self.assertEqual(str(version), '0.9.2')
+        self.assertEqual(package_info[version]['artefacts'][0]['hash'], 'sha256:abc')
+        self.assertEqual(session.get.call_args[0][0], 'https://pypi.org/pypi/tile-generator/0.9.2/json')
+
+
+def make_sdist(name='unittest', version='0.9.2', padding=0):
+    """ Build a minimal sdist in memory, with `padding` random bytes of data after PKG-INFO. """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        pkg_info = 'Metadata-Version: 2.1\nName: {}\nVersion: {}\nSummary: test\n'.format(name, version).encode()
+        info = tarfile.TarInfo('{}-{}/PKG-INFO'.format(name, version))
+        info.size = len(pkg_info)
+        archive.addfile(info, io.BytesIO(pkg_info))
+        if padding:
+            info = tarfile.TarInfo('{}-{}/data.bin'.format(name, version))
+            info.size = padding
+            archive.addfile(info, io.BytesIO(os.urandom(padding)))
+    return buffer.getvalue()
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.resconfig = common.merge_defaults(make_input(None))
+        self.content = make_sdist()
+
+    def mock_response(self, mock_session):
+        session = mock_session.return_value.__enter__.return_value
+        response = session.get.return_value.__enter__.return_value
+        response.iter_content.return_value = [self.content[:100], self.content[100:]]
+        return session
+
+    @patch('pypi_resource.pipio._build_session')
+    def test_download_verified(self, mock_session):
+        self.mock_response(mock_session)
+        digest = 'sha256:' + hashlib.sha256(self.content).hexdigest()
+        path = pipio.pip_download_link(self.resconfig, 'https://foo/unittest-0.9.2.tar.gz', self.tmpdir.name, digest)
+        self.assertEqual(path, os.path.join(self.tmpdir.name, 'unittest-0.9.2.tar.gz'))
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ['PKG-INFO', 'unittest-0.9.2.tar.gz'])
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), self.content)
+
+    @patch('pypi_resource.pipio._build_session')
+    def test_download_hash_mismatch(self, mock_session):
+        self.mock_response(mock_session)
+        with self.assertRaises(pipio.HashMismatchError):
+            pipio.pip_download_link(self.resconfig, 'https://foo/unittest-0.9.2.tar.gz', self.tmpdir.name, 'sha256:0000')
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    @patch('pypi_resource.pipio.unpack_archive')
+    @patch('pypi_resource.pipio._download')
+    def test_download_links_unpack_serially(self, mock_download, mock_unpack):
+        events = []
+        mock_download.side_effect = lambda session, url, path, *args: events.append(('download', path))
+        mock_unpack.side_effect = lambda path, destdir: events.append(('unpack', path))
+        artefacts = [{'filename': name, 'url': 'https://foo/' + name, 'hash': None}
+                     for name in ['unittest-0.9.2.tar.gz', 'unittest-0.9.2-py3-none-any.whl', 'unittest-0.9.2.zip']]
+        paths = pipio.pip_download_links(self.resconfig, artefacts, self.tmpdir.name, 3, session=MagicMock())
+        self.assertEqual(paths, [os.path.join(self.tmpdir.name, a['filename']) for a in artefacts])
+        # all downloads are done before the sdists are unpacked, in the selected order
+        self.assertEqual([event for event, path in events[:3]], ['download'] * 3)
+        self.assertEqual(events[3:], [('unpack', paths[0]), ('unpack', paths[2])])
+
+    def interrupted_session(self, resumed_status=206):
+        """ Session whose first response breaks off after 100 bytes, the second one serves the rest. """
+        def interrupted(chunk_size):
+            yield self.content[:100]
+            raise requests.exceptions.ChunkedEncodingError('connection reset')
+
+        headers = {'ETag': '"v1"', 'Accept-Ranges': 'bytes'}
+        first = MagicMock(status_code=200, headers=headers, iter_content=interrupted)
+        rest = self.content[100:] if resumed_status == 206 else self.content
+        second = MagicMock(status_code=resumed_status, headers=headers, iter_content=lambda chunk_size: [rest])
+        session = MagicMock()
+        session.get.return_value.__enter__.side_effect = [first, second]
+        return session
+
+    def test_download_resumed(self):
+        session = self.interrupted_session()
+        url, digest = 'https://foo/unittest-0.9.2.tar.gz', 'sha256:' + hashlib.sha256(self.content).hexdigest()
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            pipio.pip_download_link(self.resconfig, url, self.tmpdir.name, digest, session)
+        self.assertIn('unittest-0.9.2.tar.gz.part', os.listdir(self.tmpdir.name))
+
+        with patch('sys.stderr', io.StringIO()):
+            path = pipio.pip_download_link(self.resconfig, url, self.tmpdir.name, digest, session)
+        headers = session.get.call_args[1]['headers']
+        self.assertEqual((headers['Range'], headers['If-Range']), ('bytes=100-', '"v1"'))
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ['PKG-INFO', 'unittest-0.9.2.tar.gz'])
+
+    def test_download_changed_while_resuming(self):
+        # the index ignores the range if the file changed, the download starts over
+        session = self.interrupted_session(resumed_status=200)
+        url, digest = 'https://foo/unittest-0.9.2.tar.gz', 'sha256:' + hashlib.sha256(self.content).hexdigest()
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            pipio.pip_download_link(self.resconfig, url, self.tmpdir.name, digest, session)
+        path = pipio.pip_download_link(self.resconfig, url, self.tmpdir.name, digest, session)
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), self.content)
+
+
+class TestIn(unittest.TestCase):
+    def setUp(self):
+        self.artefacts = [
+            {'filename': 'unittest-0.9.2-cp39-cp39-manylinux2014_x86_64.whl', 'url': 'u1', 'hash': 'None:None'},
+            {'filename': 'unittest-0.9.2-cp39-cp39-win_amd64.whl', 'url': 'u2', 'hash': 'None:None'},
+            {'filename': 'unittest-0.9.2.tar.gz', 'url': 'u3', 'hash': 'None:None'},
+        ]
+
+    def test_select_artefacts(self):
+        self.assertEqual(in_.select_artefacts(self.artefacts, None), self.artefacts[:1])
+        self.assertEqual(in_.select_artefacts(self.artefacts, 'all'), self.artefacts)
+        self.assertEqual(in_.select_artefacts(self.artefacts, '*.tar.gz'), self.artefacts[2:])
+        self.assertEqual(in_.select_artefacts(self.artefacts, ['*manylinux*', '*win*']), self.artefacts[:2])
+
+    @patch('pypi_resource.retry.time.sleep')
+    @patch('pypi_resource.pipio.pip_get_versions')
+    def test_list_version_not_found(self, mock_versions, mock_sleep):
+        policy = retry.RetryPolicy(count=3)
+        listed = {pipio.Version('0.9.1'): {'artefacts': self.artefacts, 'metadata': {'package_key': 'unittest'}}}
+        # the version is not listed yet, but others are
+        mock_versions.side_effect = lambda resconfig, session, version=None: {} if version else listed
+        resconfig = common.merge_defaults(make_input({'version': '0.9.2'}))
+        with self.assertRaises(in_.VersionNotFoundError), patch('sys.stderr', io.StringIO()):
+            policy.call(in_.list_version, resconfig)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+        # the first release of a package is not listed yet
+        mock_sleep.reset_mock()
+        mock_versions.side_effect = None
+        mock_versions.return_value = {}
+        with self.assertRaises(in_.VersionNotFoundError), patch('sys.stderr', io.StringIO()):
+            policy.call(in_.list_version, resconfig)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+        # unknown package (the project page answered 404) or nothing matches the selection
+        mock_sleep.reset_mock()
+        with self.assertRaises(in_.NoMatchingPackagesError):
+            policy.call(in_.list_version, common.merge_defaults(make_input(None)))
+        mock_sleep.assert_not_called()
+
+    @patch('pypi_resource.pipio.pip_download_links')
+    @patch('pypi_resource.pipio.pip_get_versions')
+    def test_download_all(self, mock_versions, mock_download):
+        mock_versions.return_value = {
+            pipio.Version('0.9.2'): {'artefacts': self.artefacts, 'metadata': {'package_key': 'unittest'}},
+        }
+        resconfig = common.merge_defaults(make_input(None))
+        resconfig['params'] = {'artefacts': ['*.whl'], 'download_workers': 2}
+        response, pkg_info = in_.download_version(resconfig, '/dest')
+        mock_download.assert_called_once_with(resconfig, self.artefacts[:2], '/dest', 2, policy=ANY, session=ANY)
+        self.assertIsNone(pkg_info)
+        self.assertEqual(response['version'], {'version': '0.9.2'})
+        self.assertEqual(response['metadata']['filename'], self.artefacts[0]['filename'])
+
+    @patch('pypi_resource.retry.time.sleep')
+    @patch('pypi_resource.pipio.pip_download_link')
+    @patch('pypi_resource.pipio.pip_get_versions')
+    def test_retry_download_stage_only(self, mock_versions, mock_download, mock_sleep):
+        mock_versions.return_value = {
+            pipio.Version('0.9.2'): {'artefacts': self.artefacts, 'metadata': {'package_key': 'unittest'}},
+        }
+        mock_download.side_effect = [requests.ConnectionError('reset'), '/dest/unittest.whl']
+        resconfig = common.merge_defaults(make_input({'version': '0.9.2'}))
+        with patch('sys.stderr', io.StringIO()):
+            in_.download_version(resconfig, '/dest', retry.RetryPolicy(count=3, delay=2))
+        self.assertEqual(mock_download.call_count, 2)
+        mock_versions.assert_called_once()
+        self.assertTrue(1 <= mock_sleep.call_args[0][0] <= 2)
+
+    @patch('pypi_resource.pipio.pip_download_link')
+    @patch('pypi_resource.pipio.pip_get_versions')
+    def test_version_artefact(self, mock_versions, mock_download):
+        version = {'version': '0.9.2', 'filename': 'unittest-0.9.2.tar.gz', 'hash': 'sha256:abc', 'url': 'u3'}
+        resconfig = common.merge_defaults(make_input(dict(version)))
+        response, unused_pkg_info = in_.download_version(resconfig, '/dest')
+        mock_versions.assert_not_called()
+        mock_download.assert_called_once_with(resconfig, 'u3', '/dest', 'sha256:abc', ANY)
+        self.assertEqual(response['metadata']['filename'], 'unittest-0.9.2.tar.gz')
+
+        # the recorded url is gone
+        response = MagicMock(status_code=404)
+        mock_download.side_effect = [requests.HTTPError('404 Not Found', response=response), '/dest/unittest.tar.gz']
+        mock_versions.return_value = {
+            pipio.Version('0.9.2'): {'artefacts': self.artefacts[2:], 'metadata': {'package_key': 'unittest'}},
+        }
+        with patch('sys.stderr', io.StringIO()):
+            in_.download_version(resconfig, '/dest')
+        mock_versions.assert_called_once()
+        self.assertEqual(mock_download.call_args[0][1], 'u3')
+
+        resconfig['params'] = {'artefacts': 'all'}
+        self.assertIsNone(in_.version_artefact(resconfig))
+
+
+class TestRetry(unittest.TestCase):
+    def http_error(self, status, headers=None):
+        return requests.HTTPError(response=MagicMock(status_code=status, headers=headers or {}))
+
+    def test_classification(self):
+        self.assertTrue(retry.is_transient(requests.ConnectionError()))
+        self.assertTrue(retry.is_transient(requests.Timeout()))
+        self.assertTrue(retry.is_transient(self.http_error(503)))
+        self.assertTrue(retry.is_transient(self.http_error(429)))
+        self.assertTrue(retry.is_transient(in_.VersionNotFoundError('not yet')))
+        self.assertTrue(retry.is_transient(requests.exceptions.RetryError()))
+        self.assertFalse(retry.is_transient(self.http_error(404)))
+        self.assertFalse(retry.is_transient(pipio.HashMismatchError()))
+        self.assertFalse(retry.is_transient(KeyError('UNKNOWN keys within source')))
+
+    def test_session_leaves_error_responses_to_policy(self):
+        with pipio._build_session(common.merge_defaults(make_input(None))) as session:
+            max_retries = session.get_adapter('https://pypi.org/simple/').max_retries
+        self.assertFalse(max_retries.status_forcelist)
+
+    def test_session_verify_index_host(self):
+        resconfig = common.merge_defaults(make_input(None))
+        with pipio._build_session(resconfig) as session:
+            self.assertNotIsInstance(session.get_adapter('https://pypi.org/simple/'), pipio._IndexHostAdapter)
+
+        resconfig['source']['repository']['index_url'] = 'https://nexus.local:8443/repository/pypi/simple'
+        resconfig['source']['repository']['verify'] = False
+        with pipio._build_session(resconfig) as session:
+            adapter = session.get_adapter('https://nexus.local:8443/repository/pypi/packages/foo-1.0.tar.gz')
+            self.assertIsInstance(adapter, pipio._IndexHostAdapter)
+            self.assertNotIsInstance(session.get_adapter('https://files.pythonhosted.org/'), pipio._IndexHostAdapter)
+            with patch('requests.adapters.HTTPAdapter.send') as mock_send:
+                adapter.send(MagicMock(), verify=True)
+            self.assertFalse(mock_send.call_args[1]['verify'])
+
+    def test_retry_after(self):
+        self.assertEqual(retry.retry_after(self.http_error(429, {'Retry-After': '7'})), 7)
+        self.assertEqual(retry.retry_after(self.http_error(503, {'Retry-After': 'Thu, 01 Jan 1970 00:00:00 GMT'})), 0)
+        self.assertIsNone(retry.retry_after(self.http_error(503)))
+
+    @patch('pypi_resource.retry.time.sleep')
+    def test_policy(self, mock_sleep):
+        policy = retry.RetryPolicy(count=4, delay=1, max_delay=3)
+        failing = MagicMock(side_effect=[self.http_error(502), self.http_error(429, {'Retry-After': '5'}),
+                                         requests.ConnectionError(), 'done'])
+        with patch('sys.stderr', io.StringIO()):
+            self.assertEqual(policy.call(failing, stage='unit test'), 'done')
+        waits = [call[0][0] for call in mock_sleep.call_args_list]
+        self.assertTrue(0.5 <= waits[0] <= 1)
+        self.assertEqual(waits[1], 5)
+        self.assertTrue(1.5 <= waits[2] <= 3)
+
+        permanent = MagicMock(side_effect=self.http_error(401))
+        with self.assertRaises(requests.HTTPError):
+            policy.call(permanent)
+        self.assertEqual(permanent.call_count, 1)
+
+
+def make_wheel(name='unittest', version='0.9.2', padding=0, summary='test'):
+    """ Build a minimal wheel in memory, optionally padded with an incompressible payload. """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('{}/data.bin'.format(name), os.urandom(padding))
+        archive.writestr('{}-{}.dist-info/METADATA'.format(name, version),
+                         'Metadata-Version: 2.1\nName: {}\nVersion: {}\nSummary: {}\nPlatform: linux\n'.format(
+                             name, version, summary))
+    return buffer.getvalue()
+
+
+class FakeRangeSession:
+    """ Serves `content` with support for HEAD and single range GET requests. """
+
+    def __init__(self, content):
+        self.content = content
+        self.requests = []
+
+    def head(self, url, **kwargs):
+        return MagicMock(url=url, headers={'Accept-Ranges': 'bytes', 'Content-Length': str(len(self.content))})
+
+    def get(self, url, headers=None, **kwargs):
+        start, end = headers['Range'][len('bytes='):].split('-')
+        self.requests.append((int(start), int(end)))
+        return MagicMock(status_code=206, content=self.content[int(start):int(end) + 1])
+
+
+class TestMetadata(unittest.TestCase):
+    def test_parse_metadata(self):
+        data = 'Metadata-Version: 2.1\nName: unittest\nVersion: 0.9.2\nSummary: Schnell \u2013 fast\n' \
+               'Requires-Python: >=3.6\n\nbody'.encode('utf-8')
+        parsed = metadata.parse_metadata(data)
+        self.assertEqual(parsed, {
+            'version': '0.9.2',
+            'metadata': {'package_name': 'unittest', 'summary': 'Schnell \u2013 fast', 'home_page': None,
+                         'platforms': '', 'requires_python': '>=3.6'},
+        })
+        self.assertIsInstance(parsed['metadata']['summary'], str)
+        json.dumps(parsed)
+        # legacy metadata in latin-1
+        self.assertEqual(metadata.parse_metadata('Name: m\xfcll\n'.encode('latin-1'))['metadata']['package_name'],
+                         'm\xfcll')
+
+    @patch('pypi_resource.common._read_package_metadata', return_value=None)
+    def test_package_info_fallback(self, mock_read):
+        import pkginfo
+
+        data = b'Metadata-Version: 1.0\nName: unittest\nVersion: 0.9.2\nSummary: UNKNOWN\nHome-page: UNKNOWN\n' \
+               b'Platform: UNKNOWN\n'
+        pkgmeta = pkginfo.Distribution()
+        pkgmeta.parse(data)
+        with patch('pkginfo.get_metadata', return_value=pkgmeta):
+            info = common.get_package_info('unittest-0.9.2.tar.gz')
+        self.assertEqual(info, metadata.parse_metadata(data))
+        self.assertEqual(info['metadata']['home_page'], None)
+        self.assertEqual(info['metadata']['platforms'], '')
+
+    def test_read_package_metadata(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # truncated after PKG-INFO: the stream is not read that far
+            content = make_sdist(padding=1024 * 1024)
+            sdist = os.path.join(tmpdir, 'unittest-0.9.2.tar.gz')
+            with open(sdist, 'wb') as file:
+                file.write(content[:len(content) // 2])
+            self.assertIn(b'Version: 0.9.2', metadata.read_package_metadata(sdist))
+
+            wheel = os.path.join(tmpdir, 'unittest-0.9.2-py3-none-any.whl')
+            with open(wheel, 'wb') as file:
+                file.write(make_wheel())
+            self.assertEqual(common.get_package_info(wheel)['metadata']['package_name'], 'unittest')
+
+            # an sdist unpacked by `in`
+            with open(os.path.join(tmpdir, 'PKG-INFO'), 'wb') as file:
+                file.write(b'Metadata-Version: 1.0\nName: unittest\nVersion: 0.9.2\nHome-page: UNKNOWN\n')
+            self.assertEqual(common.get_package_info(tmpdir)['metadata']['home_page'], None)
+            self.assertEqual(common.get_package_metadata(tmpdir).version, '0.9.2')
+
+    @patch('pypi_resource.pipio.pip_download_link')
+    @patch('pypi_resource.pipio.pip_get_versions')
+    def test_in_non_ascii_metadata(self, mock_versions, mock_download):
+        artefact = {'filename': 'unittest-0.9.2-py3-none-any.whl', 'url': 'u', 'hash': 'None:None'}
+        mock_versions.return_value = {
+            pipio.Version('0.9.2'): {'artefacts': [artefact], 'metadata': {'package_key': 'unittest'}},
+        }
+
+        def download(resconfig, url, destdir, *args):
+            with open(os.path.join(destdir, artefact['filename']), 'wb') as file:
+                file.write(make_wheel(summary='Schnell \u2013 fast'))
+
+        mock_download.side_effect = download
+        with tempfile.TemporaryDirectory() as destdir:
+            response = in_.in_(destdir, make_stream(make_input({'version': '0.9.2'})))
+        self.assertIn({'name': 'summary', 'value': 'Schnell \u2013 fast'}, json.loads(json.dumps(response))['metadata'])
+
+    def test_index_metadata_attributes(self):
+        html = '<a href="a-1.0-py3-none-any.whl" data-dist-info-metadata="sha256=abc">a</a>' \
+               '<a href="a-1.1-py3-none-any.whl" data-core-metadata="true">a</a>' \
+               '<a href="a-1.2.tar.gz">a</a>'
+        files = index.parse_html(html, 'https://foo/simple/a/')
+        self.assertEqual([f['metadata'] for f in files], [{'sha256': 'abc'}, {}, None])
+        artefact = pipio._candidate_to_package_info_artefact(index.to_candidate('a', files[0]))
+        self.assertEqual(artefact['core_metadata'], 'sha256:abc')
+
+    def test_range_read_wheel(self):
+        content = make_wheel(padding=1024 * 1024)
+        session = FakeRangeSession(content)
+        rangefile = metadata.HttpRangeFile(session, 'https://foo/unittest-0.9.2-py3-none-any.whl', 1)
+        data = metadata.read_wheel_metadata(rangefile)
+        self.assertIn(b'Version: 0.9.2', data)
+        self.assertLess(rangefile.bytes_fetched, len(content) / 10)
+
+    @patch('pypi_resource.pipio._build_session')
+    @patch('pypi_resource.pipio.pip_get_versions')
+    def test_in_metadata_only(self, mock_versions, mock_session):
+        artefact = {'filename': 'unittest-0.9.2-py3-none-any.whl', 'url': 'https://foo/unittest-0.9.2-py3-none-any.whl',
+                    'hash': 'None:None', 'core_metadata': ''}
+        mock_versions.return_value = {
+            pipio.Version('0.9.2'): {'artefacts': [artefact], 'metadata': {'package_key': 'unittest'}},
+        }
+        session = mock_session.return_value.__enter__.return_value
+        session.get.return_value = MagicMock(ok=True, content=b'Metadata-Version: 2.1\nName: unittest\nVersion: 0.9.2\n')
+        resconfig = make_input({'version': '0.9.2'})
+        resconfig['params'] = {'metadata_only': True}
+        with tempfile.TemporaryDirectory() as destdir:
+            response = in_.in_(destdir, make_stream(resconfig))
+            self.assertEqual(sorted(os.listdir(destdir)), ['semver', 'version'])
+        session.get.assert_called_once_with(artefact['url'] + '.metadata', timeout=pipio.TIMEOUT)
+        self.assertIn({'name': 'package_name', 'value': 'unittest'}, response['metadata'])
+        # listing and metadata share one session
+        mock_session.assert_called_once()
+        self.assertIs(mock_versions.call_args[0][1], session)
+
+
+class TestFindPackage(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.srcdir = tmpdir.name
+        for filename in ['unittest-0.9.2.tar.gz', 'unittest-0.10.0-py3-none-any.whl', 'unit-test-0.9.5.tar.gz']:
+            open(os.path.join(self.srcdir, filename), 'w').close()
+
+    def test_filename_version(self):
+        self.assertEqual(out.filename_version('unittest-0.10.0-py3-none-any.whl'), pipio.Version('0.10.0'))
+        self.assertEqual(out.filename_version('unit_test-0.9.5.tar.gz'), pipio.Version('0.9.5'))
+        self.assertIsNone(out.filename_version('unit-test-0.9.5.tar.gz'))
+        self.assertEqual(out.filename_version('unit-test-0.9.5.tar.gz', 'unit-test'), pipio.Version('0.9.5'))
+        self.assertIsNone(out.filename_version('unittest-0.9.5-py3.9.egg'))
+
+    @patch('pypi_resource.common.get_package_info')
+    def test_find_package(self, mock_info):
+        mock_info.return_value = {'version': '0.11.0'}
+        self.assertEqual(out.find_package('*', self.srcdir, 'unit-test'),
+                         os.path.join(self.srcdir, 'unittest-0.10.0-py3-none-any.whl'))
+        mock_info.assert_not_called()
+
+        # only the ambiguous filename gets opened
+        self.assertEqual(out.find_package('*', self.srcdir),
+                         os.path.join(self.srcdir, 'unit-test-0.9.5.tar.gz'))
+        mock_info.assert_called_once_with(os.path.join(self.srcdir, 'unit-test-0.9.5.tar.gz'))
+
+
+class TestUpload(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.pkgpath = os.path.join(tmpdir.name, 'unittest-0.9.2.tar.gz')
+        self.content = make_sdist()
+        with open(self.pkgpath, 'wb') as file:
+            file.write(self.content)
+
+    def parse_body(self, body, content_type):
+        data = b''.join(iter(lambda: body.read(1000), b''))
+        self.assertEqual(len(data), len(body))
+        message = email.parser.BytesParser().parsebytes(b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + data)
+        return [(part.get_param('name', header='content-disposition'), part.get_payload(decode=True))
+                for part in message.get_payload()]
+
+    def test_upload(self):
+        session = MagicMock()
+        session.post.return_value = MagicMock(ok=True, is_redirect=False)
+        with patch('pypi_resource.upload.requests.Session') as mock_session:
+            mock_session.return_value.__enter__.return_value = session
+            out.upload_package(self.pkgpath, {'source': {'repository': {
+                'username': 'u', 'password': 'p', 'repository_url': 'https://upload.example.org/legacy/'}}})
+        args, kwargs = session.post.call_args
+        self.assertEqual(args, ('https://upload.example.org/legacy/', ))
+        self.assertEqual(kwargs['auth'], ('u', 'p'))
+        fields = self.parse_body(kwargs['data'], kwargs['headers']['Content-Type'])
+        self.assertIn((':action', b'file_upload'), fields)
+        self.assertIn(('name', b'unittest'), fields)
+        self.assertIn(('version', b'0.9.2'), fields)
+        self.assertIn(('filetype', b'sdist'), fields)
+        # the digests are computed while the content is sent and follow it
+        self.assertEqual(fields[-4], ('content', self.content))
+        self.assertEqual(fields[-3:], [
+            ('md5_digest', hashlib.md5(self.content).hexdigest().encode()),
+            ('sha256_digest', hashlib.sha256(self.content).hexdigest().encode()),
+            ('blake2_256_digest', hashlib.blake2b(self.content, digest_size=32).hexdigest().encode()),
+        ])
+
+    def test_streamed_body_progress(self):
+        body = upload.MultipartBody([('name', 'unittest')], self.pkgpath, chunk_size=64, progress_interval=0.01)
+        with patch('sys.stderr', io.StringIO()) as stderr, body.progress():
+            # a stalled upload is reported as well
+            time.sleep(0.05)
+            fields = self.parse_body(body, body.content_type)
+        self.assertEqual(fields[-1], ('content', self.content))
+        self.assertEqual(body.bytes_read, len(body))
+        self.assertIn('Uploading unittest-0.9.2.tar.gz: 0.0 of 0.0 MiB (0%) at 0.0 MiB/s', stderr.getvalue())
+        # the file is read in chunks of at most chunk_size bytes
+        chunks = list(upload.MultipartBody([], self.pkgpath, chunk_size=64)._iterate())
+        self.assertEqual(max(len(chunk) for chunk in chunks[1:-1]), 64)
+
+        for chunk_size in [0, -1, None]:
+            with self.assertRaises(ValueError):
+                upload.MultipartBody([], self.pkgpath, chunk_size=chunk_size)
+
+    @patch('pypi_resource.out.upload_package')
+    @patch('pypi_resource.pipio._fetch_index_files')
+    def test_skip_existing(self, mock_files, mock_upload):
+        srcdir = os.path.dirname(self.pkgpath)
+        digest = hashlib.sha256(self.content).hexdigest()
+        mock_files.return_value = [{'filename': 'unittest-0.9.2.tar.gz', 'url': 'u', 'hashes': {'sha256': digest}}]
+        input = make_input(None, name='unittest')
+        input['params'] = {'glob': '*.tar.gz', 'skip_existing': True}
+        with patch('sys.stderr', io.StringIO()):
+            self.assertEqual(out.out(srcdir, copy.deepcopy(input)), {'version': {'version': '0.9.2'}})
+        mock_upload.assert_not_called()
+        self.assertEqual(upload.file_digest(self.pkgpath), digest)
+
+        mock_files.return_value = [{'filename': 'unittest-0.9.2.tar.gz', 'url': 'u', 'hashes': {'sha256': '0'}}]
+        with self.assertRaises(out.UploadConflictError), patch('sys.stderr', io.StringIO()):
+            out.out(srcdir, copy.deepcopy(input))
+
+        mock_files.return_value = []
+        with patch('sys.stderr', io.StringIO()):
+            out.out(srcdir, copy.deepcopy(input))
+        mock_upload.assert_called_once()
+
+    @patch('pypi_resource.retry.time.sleep')
+    @patch('pypi_resource.out.upload_package')
+    @patch('pypi_resource.pipio._query_candidates')
+    def test_version_artefact(self, mock_query, mock_upload, mock_sleep):
+        candidates = [index.Candidate('unittest', pipio.Version('0.9.2'), 'unittest-0.9.2.tar.gz', 'https://foo/u',
+                                      {'sha256': 'abc'})]
+        # listed by the index after a moment
+        mock_query.side_effect = [[], candidates, candidates]
+        input = make_input(None, name='unittest', version_artefact=True, packaging='source')
+        input['params'] = {'glob': '*.tar.gz'}
+        with patch('sys.stderr', io.StringIO()):
+            response = out.out(os.path.dirname(self.pkgpath), copy.deepcopy(input))
+        mock_upload.assert_called_once()
+        # the same version check reports
+        self.assertEqual(response['version'], check.check(make_input_stream(
+            {'version': '0.9.2'}, name='unittest', version_artefact=True, packaging='source'))[0])
+        self.assertEqual(response['version']['url'], 'https://foo/u')
+
+    def test_upload_error(self):
+        session = MagicMock()
+        session.post.return_value = MagicMock(ok=False, is_redirect=False, status_code=400, reason='File already exists')
+        with self.assertRaises(upload.UploadError):
+            upload.upload(self.pkgpath, common.get_package_metadata(self.pkgpath), 'https://foo', 'u', 'p', session)
+
+
+def import_profile(module):
+    """ Cumulative import time in microseconds per module, as reported by `python -X importtime`. """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          cwd=os.path.join(here, '..'), stderr=subprocess.PIPE, text=True, check=True)
+    profile = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        unused_self, cumulative, name = line[len('import time:'):].split('|')
+        profile[name.strip()] = int(cumulative)
+    return profile
+
+
+class TestStartup(unittest.TestCase):
+    def assertNotImported(self, profile, prefix):
+        imported = [name for name in profile if name == prefix or name.startswith(prefix + '.')]
+        self.assertEqual(imported, [], '{} must be imported lazily'.format(prefix))
+
+    def assertWithinBudget(self, profile, module):
+        elapsed_ms = profile[module] / 1000
+        self.assertLess(elapsed_ms, import_budget_ms,
+                        'importing {} took {:.0f}ms'.format(module, elapsed_ms))
+
+    def test_check(self):
+        profile = import_profile('pypi_resource.check')
+        self.assertNotImported(profile, 'pip._internal')
+        self.assertNotImported(profile, 'pkginfo')
+        self.assertWithinBudget(profile, 'pypi_resource.check')
+
+    def test_in(self):
+        profile = import_profile('pypi_resource.in_')
+        self.assertNotImported(profile, 'pip._internal')
+        self.assertWithinBudget(profile, 'pypi_resource.in_')
+
+    def test_out(self):
+        profile = import_profile('pypi_resource.out')
+        self.assertNotImported(profile, 'pip._internal')
+        self.assertWithinBudget(profile, 'pypi_resource.out')
+
+
+class TestHashing(unittest.TestCase):
+    def test_pipeline(self):
+        chunks = [os.urandom(100000) for unused in range(20)]
+        with hashing.HashingPipeline({'sha256': hashlib.sha256(), 'md5': hashlib.md5()}, queue_size=2) as pipeline:
+            for chunk in chunks:
+                pipeline.update(chunk)
+        self.assertEqual(pipeline.hexdigests(), {
+            'sha256': hashlib.sha256(b''.join(chunks)).hexdigest(),
+            'md5': hashlib.md5(b''.join(chunks)).hexdigest(),
+        })
+        with self.assertRaises(ValueError):
+            pipeline.update(b'')
+
+
+class TestVersioning(unittest.TestCase):
+    def test_interned(self):
+        self.assertIs(versioning.parse_version('1.0.post1'), versioning.parse_version('1.0.post1'))
+        self.assertIs(versioning.as_version('2.0'), versioning.parse_version('2.0'))
+        with self.assertRaises(versioning.InvalidVersion):
+            versioning.parse_version('not a version')
+
+    def test_sort(self):
+        ordered = ['1.0.dev1', '1.0a1', '1.0rc1', '1.0', '1.0.post1', '1.1', '10.0']
+        parsed = [versioning.parse_version(v) for v in reversed(ordered)]
+        self.assertEqual([str(v) for v in versioning.sort_versions(parsed)], ordered)
+        self.assertEqual(str(versioning.max_version(parsed)), '10.0')
+        self.assertEqual(versioning.sort_versions(parsed), sorted(parsed))
+
 
 class TestOther(unittest.TestCase):
     def test_py_version_to_semver(self):